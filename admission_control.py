@@ -0,0 +1,243 @@
+"""
+gemini 子进程准入控制
+按模型限制同时运行的 gemini 进程数，超出的请求进入有界 FIFO 队列等待；
+队列已满或排队超时的请求立即被拒绝（503 + Retry-After），而不是等到 300 秒超时。
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List
+
+
+# 每个模型同时运行的 gemini 进程上限
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "4"))
+# 每个模型的等待队列长度上限
+GEMINI_MAX_QUEUE = int(os.environ.get("GEMINI_MAX_QUEUE", "16"))
+# 在队列中最长等待时间（秒）
+GEMINI_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_QUEUE_TIMEOUT_SECONDS", "60"))
+# 无法估算时返回给客户端的默认 Retry-After（秒）
+GEMINI_RETRY_AFTER_SECONDS = int(os.environ.get("GEMINI_RETRY_AFTER_SECONDS", "10"))
+
+DEFAULT_MODEL_KEY = "default"
+
+
+class AdmissionRejected(Exception):
+    """请求被准入控制拒绝"""
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: int = GEMINI_RETRY_AFTER_SECONDS):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def rejected_result(e: AdmissionRejected) -> Dict[str, Any]:
+    """
+    构建被拒绝请求的响应字典
+
+    额外带有 status_code 和 headers，路由据此返回 503/429 和 Retry-After
+    """
+    return {
+        "success": False,
+        "response": "",
+        "error": str(e),
+        "return_code": -1,
+        "status_code": e.status_code,
+        "headers": {"Retry-After": str(e.retry_after)}
+    }
+
+
+def model_from_cmd(cmd: List[str]) -> str:
+    """
+    从命令列表中提取模型名称，用作限流的 key
+
+    Args:
+        cmd: 完整命令列表
+
+    Returns:
+        模型名称，未指定时返回 "default"
+    """
+    for flag in ("--model", "-m"):
+        if flag in cmd:
+            index = cmd.index(flag)
+            if index + 1 < len(cmd):
+                return cmd[index + 1]
+    return DEFAULT_MODEL_KEY
+
+
+class _ModelLimiter:
+    """单个模型的并发限制器（信号量 + 有界 FIFO 等待队列）"""
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.running = 0
+        self._waiters: "deque[asyncio.Future]" = deque()
+
+        # 统计指标
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.completed = 0
+        self.total_queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        self.total_run_seconds = 0.0
+        self.max_run_seconds = 0.0
+
+    def estimate_retry_after(self) -> int:
+        """根据平均运行时间和排队长度估算客户端应等待的秒数"""
+        if not self.completed:
+            return GEMINI_RETRY_AFTER_SECONDS
+        avg_run = self.total_run_seconds / self.completed
+        rounds = (len(self._waiters) + 1) / max(self.max_concurrency, 1)
+        return max(1, math.ceil(avg_run * rounds))
+
+    async def acquire(self):
+        """获取运行名额，必要时排队；队列满或超时抛出 AdmissionRejected"""
+        if self.running < self.max_concurrency and not self._waiters:
+            self.running += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(
+                f"gemini 请求过多，等待队列已满（{self.max_queue}）",
+                retry_after=self.estimate_retry_after()
+            )
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not self._abandon(waiter):
+                return
+            self.timed_out += 1
+            raise AdmissionRejected(
+                f"gemini 请求排队超时（{self.queue_timeout:g} 秒）",
+                retry_after=self.estimate_retry_after()
+            )
+        except asyncio.CancelledError:
+            if not self._abandon(waiter):
+                # 名额已经交给了这个等待者，需要归还
+                self.release()
+            raise
+
+    def _abandon(self, waiter: asyncio.Future) -> bool:
+        """
+        放弃排队
+
+        Returns:
+            成功放弃返回 True；如果名额已经移交给该等待者则返回 False
+        """
+        if waiter.done():
+            return False
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        return True
+
+    def release(self):
+        """归还名额：优先直接移交给队首的等待者"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "queued": len(self._waiters),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "completed": self.completed,
+            "avg_queue_seconds": round(self.total_queue_seconds / self.admitted, 3) if self.admitted else 0.0,
+            "max_queue_seconds": round(self.max_queue_seconds, 3),
+            "avg_run_seconds": round(self.total_run_seconds / self.completed, 3) if self.completed else 0.0,
+            "max_run_seconds": round(self.max_run_seconds, 3)
+        }
+
+
+class AdmissionController:
+    """按模型划分的 gemini 子进程准入控制器"""
+
+    def __init__(
+        self,
+        max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+        max_queue: int = GEMINI_MAX_QUEUE,
+        queue_timeout: float = GEMINI_QUEUE_TIMEOUT_SECONDS
+    ):
+        """
+        初始化准入控制器
+
+        Args:
+            max_concurrency: 每个模型同时运行的进程上限
+            max_queue: 每个模型的等待队列长度上限
+            queue_timeout: 排队最长等待时间（秒）
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._limiters: Dict[str, _ModelLimiter] = {}
+
+    def _limiter(self, model: Optional[str]) -> _ModelLimiter:
+        key = model or DEFAULT_MODEL_KEY
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = _ModelLimiter(self.max_concurrency, self.max_queue, self.queue_timeout)
+            self._limiters[key] = limiter
+        return limiter
+
+    @asynccontextmanager
+    async def slot(self, model: Optional[str]):
+        """
+        在准入名额内执行一段代码
+
+        用法:
+            async with admission_controller.slot(model):
+                ...  # 启动并等待 gemini 进程
+
+        Raises:
+            AdmissionRejected: 队列已满或排队超时
+        """
+        limiter = self._limiter(model)
+        queued_at = time.monotonic()
+        await limiter.acquire()
+
+        started_at = time.monotonic()
+        queue_seconds = started_at - queued_at
+        limiter.admitted += 1
+        limiter.total_queue_seconds += queue_seconds
+        limiter.max_queue_seconds = max(limiter.max_queue_seconds, queue_seconds)
+        try:
+            yield
+        finally:
+            run_seconds = time.monotonic() - started_at
+            limiter.completed += 1
+            limiter.total_run_seconds += run_seconds
+            limiter.max_run_seconds = max(limiter.max_run_seconds, run_seconds)
+            limiter.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取各模型的准入统计信息
+
+        Returns:
+            模型名称 -> 统计字典
+        """
+        return {model: limiter.stats() for model, limiter in self._limiters.items()}
+
+
+# 全局准入控制器（GeminiCLIClient 与 GeminiSessionSimple 共享同一份并发额度）
+admission_controller = AdmissionController()
@@ -1,6 +1,15 @@
 import re
 import json
-from redis_utils import query_redis, set_redis
+import hashlib
+from redis_utils import query_redis_many, query_redis_json_many, set_redis_many, incr_redis_many, merge_redis_records
+
+
+# 个人进展记录的去重字段（指纹 = 这些字段按顺序拼接后的 SHA1）
+PROGRESS_FIELDS = ["User", "Jira_ID", "Jira_Title", "Date", "Content", "Comment"]
+
+def story_version_key(story_id):
+    """story 内容版本号的 Redis Key：进度或标签每次写入后加 1，用作 /story/description 的 ETag"""
+    return f"story:version:{story_id}"
 
 # 原始 Markdown 数据
 markdown_data = "## 🚁 Plum 25R3.2 Sprint 2 : ORI-114277 整体进展综述\n> **当前状态**: QA In Progress | **整体进度**: 4/11\n> **风险提示**: 🟠 进度滞后\n\n**📝 最新情况摘要**:\nStory 主要研发工作已完成并转入测试阶段。过去两天，开发人员 Garry Peng 集中处理了三个相关的子任务/缺陷，并记录了 3.5 小时工时，主要解决了多个富文本字段在特定场景下的显示和值清空问题。QA 负责人 Zijie Tang 已开始介入，并要求提供用于PS代码自定义逻辑的Demo数据。\n\n---\n\n## 👥 团队成员详细动态 (过去两天)\n\n### 👤 Chuan Huang\n\n#### 🔹 ORI-136135 【admin】longtext 字段在初始拖入页面时，设置关联字段的固定值输入框，没有展示富文本样式 ([🔵 task])\n* **2026-01-23**:\n    * **[Comment]** [~garry.peng@veeva.com] feature/ORI-136135/admin-affect-others-support-long-text\n上面分支加上了\n\n### 👤 Garry Peng\n\n#### 🔹 ORI-136183 【admin】 longtext 字段为文本类型时，配置字段影响关系页面，在关联字段配置固定值处输入带标签的内容，在预览页面会变成富文本的样式 ([🔵 task])\n* **2026-01-23**:\n    * **[Worklog 1h]** \n\n#### 🔹 ORI-136135 【admin】longtext 字段在初始拖入页面时，设置关联字段的固定值输入框，没有展示富文本样式 ([🔵 task])\n* **2026-01-22**:\n    * **[Worklog 30m]** \n    * **[Comment]** /admin-api/object/\\{object_id}/page-layout/\\{layout_id}/ 接口返回的 all_fields 中的字段也需要带上 text_type [~chuan.huang@veeva.com] \n\n!image-2026-01-22-17-37-48-539.png!\n* **2026-01-23**:\n    * **[Worklog 1h]** \n\n#### 🔹 ORI-136130 【online】 控制字段将longtext 字段 带入值后，再将控制字段的值清空，longtext 字段的值未清空 ([🔴 defect])\n* **2026-01-22**:\n    * **[Worklog 1h 30m]** \n\n### 👤 Zijie Tang\n\n#### 🔹 ORI-136130 【online】 控制字段将longtext 字段 带入值后，再将控制字段的值清空，longtext 字段的值未清空 ([🔴 defect])\n* **2026-01-22**:\n    * **[Comment]** wechat 端同样存在这个问题\n\n---\n*注：报表生成时间 2026-01-24*"
@@ -8,7 +17,7 @@ markdown_data = "## 🚁 Plum 25R3.2 Sprint 2 : ORI-114277 整体进展综述\n>
 
 def parse_to_json(text, story_id):
     """
-    解析Markdown并将结果保存/合并到指定Sprint和Story的文件中。
+    解析Markdown并将结果合并到指定Story的个人进展记录中，返回本次解析出的记录。
     Sprint ID 会从 text 的第一行标题中自动提取。
     """
 
@@ -82,63 +91,104 @@ def parse_to_json(text, story_id):
     # 2. Redis 操作逻辑
     # ---------------------------------------------------------
 
-    # 构造 Redis Key, 格式: story:personal_progress:{story_id}
+    # 记录列表 story:personal_progress:{story_id}，指纹集合 story:personal_progress_fp:{story_id}
     redis_key = f"story:personal_progress:{story_id}"
 
-    # 从 Redis 读取现有数据
-    existing_data = query_redis('GET', redis_key)
-    if not isinstance(existing_data, list):
-        final_data = []
-    else:
-        final_data = existing_data
-    
-    print(f"从 Redis (Key: {redis_key}) 读取了 {len(final_data)} 条已有数据。")
-
-    # 数据追加逻辑
-    append_count = 0
-    for new_item in new_parsed_data:
-        if new_item not in final_data:
-            final_data.append(new_item)
-            append_count += 1
-
-    if append_count > 0:
-        print(f"成功追加 {append_count} 条新记录。")
-        # 将最终结果写回 Redis
-        set_redis(redis_key, final_data)
-        print(f"数据已写回 Redis (Key: {redis_key})。")
+    # 去重、追加、更新版本号都在 Redis 中原子完成（redis_utils.MERGE_RECORDS_SCRIPT），并发的 story_check 不会互相覆盖
+    append_count = merge_redis_records(
+        redis_key,
+        f"story:personal_progress_fp:{story_id}",
+        new_parsed_data,
+        PROGRESS_FIELDS,
+        version_key=story_version_key(story_id)
+    )
+
+    if append_count:
+        print(f"成功追加 {append_count} 条新记录 (Key: {redis_key})。")
+    elif append_count is None:
+        print(f"写入 Redis 失败 (Key: {redis_key})。")
     else:
         print("没有新记录需要追加（数据已存在 或 解析结果为空）。")
 
-    return final_data
+    return new_parsed_data
+
+
+def save_story_tags(story_tags, expiry_seconds=None):
+    """
+    批量保存 story 标签（一次往返），并更新这些 story 的版本号
+    story_tags: 以 story_id 为 key、标签列表为值的字典
+    """
+    if not story_tags:
+        return
+    set_redis_many({f"story:tags:{story_id}": tags for story_id, tags in story_tags.items()},
+                   expiry_seconds=expiry_seconds)
+    incr_redis_many([story_version_key(story_id) for story_id in story_tags])
+
+
+def get_story_versions(story_ids):
+    """
+    批量读取 story 的版本号（只读版本号 key，不读进度和标签）
+    返回以 story_id 为 key 的字典，没有版本号的 story 为 0
+    """
+    story_ids = list(dict.fromkeys(story_ids))
+    values = query_redis_many([story_version_key(story_id) for story_id in story_ids])
+    return {story_id: value if isinstance(value, int) else 0 for story_id, value in zip(story_ids, values)}
+
+
+def story_etag(versions):
+    """
+    根据版本号生成 ETag
+    versions: get_story_versions 的结果；单个 story 时直接使用版本号，多个 story 时对 id 和版本号取摘要
+    """
+    if len(versions) == 1:
+        story_id, version = next(iter(versions.items()))
+        return f'W/"{story_id}-{version}"'
+    digest = hashlib.sha1(json.dumps(sorted(versions.items())).encode("utf-8")).hexdigest()
+    return f'W/"{digest}"'
 
 
 def get_story_description(story_id):
-    # 1. Get personal progress data
-    personal_progress_key = f"story:personal_progress:{story_id}"
-    personal_process_data = query_redis('GET', personal_progress_key)
+    return get_story_descriptions([story_id])[story_id]
 
-    # 2. Get tags data
-    tags_key = f"story:tags:{story_id}"
-    tags_data = query_redis('GET', tags_key)
 
-    # If both are missing, return an error
-    if not personal_process_data and not tags_data:
-        return {"error": f"在 Redis 中未找到 story '{story_id}' 的任何相关数据（进度或标签）。"}
+def get_story_descriptions(story_ids):
+    """
+    批量获取多个 story 的进度和标签：所有 key 在一次往返中读取
+    返回以 story_id 为 key 的字典，每个值与 get_story_description 的结果相同
+    """
+    story_ids = list(dict.fromkeys(story_ids))  # 去重并保持顺序
+
+    # 1. story:personal_progress:{id}（列表）和 story:tags:{id} 一起读取
+    keys = []
+    for story_id in story_ids:
+        keys.append(f"story:personal_progress:{story_id}")
+        keys.append(f"story:tags:{story_id}")
+    values = query_redis_json_many(keys)
+
+    results = {}
+    for index, story_id in enumerate(story_ids):
+        personal_process_data = values[index * 2]
+        tags_data = values[index * 2 + 1]
+
+        # If both are missing, return an error
+        if not personal_process_data and not tags_data:
+            results[story_id] = {"error": f"在 Redis 中未找到 story '{story_id}' 的任何相关数据（进度或标签）。"}
+            continue
 
-    # 3. Combine into the final dictionary
-    result = {
-        "tags": tags_data if tags_data else [],
-        "personal_process_data": personal_process_data if personal_process_data else []
-    }
+        # 2. Combine into the final dictionary
+        results[story_id] = {
+            "tags": tags_data if tags_data else [],
+            "personal_process_data": personal_process_data if personal_process_data else []
+        }
 
-    return result
+    return results
 
 
 # --- 测试调用 ---
 if __name__ == "__main__":
     try:
         result = parse_to_json(markdown_data, story_id="ORI-114277")
-        print(f"\n最终数据条数: {len(result)}")
+        print(f"\n本次解析条数: {len(result)}")
         if len(result) > 0:
             print("预览第一条数据:")
             print(json.dumps(result[:1], indent=2, ensure_ascii=False))
@@ -0,0 +1,154 @@
+"""
+Redis 存储后端基准测试：webdis（HTTP 网关） vs RESP（redis-py 直连）
+
+按 story:* 的实际用法构造数据（标签列表、个人进展记录列表），分别测量：
+- tags_set:       SETEX story:tags:{id}（story_list 写入标签）
+- tags_get:       GET story:tags:{id}
+- progress_merge: merge_redis_records 追加一条新记录（parse_to_json 写入）
+- progress_get:   GET_JSON_MANY_SCRIPT 读取个人进展记录列表（LRANGE，拼成一个 JSON 数组）
+- description:    MGET 版本号 + GET_JSON_MANY_SCRIPT 读取进度和标签（/story/description）
+
+测试数据写在 --prefix 指定的命名空间下（默认 bench:），结束后删除，不会影响真实数据。
+
+用法:
+    python benchmark_redis_backends.py --stories 50 --rounds 5
+    REDIS_URL=redis://localhost:6379/0 WEBDIS_URL=http://localhost:7379 python benchmark_redis_backends.py
+"""
+import argparse
+import json
+import statistics
+import time
+from typing import Callable, Dict, List
+
+import redis_utils
+from analyze_data_storage import PROGRESS_FIELDS
+from redis_utils import GET_JSON_MANY_SCRIPT, MERGE_RECORDS_SCRIPT, RespBackend, WebdisBackend
+
+
+def build_progress(story_id: str, count: int, start: int = 0) -> List[Dict[str, str]]:
+    """构造与 parse_to_json 结果结构相同的个人进展记录"""
+    return [
+        {
+            "User": f"User {i % 5}",
+            "Jira_ID": f"{story_id}-{i % 7}",
+            "Jira_Title": "【admin】longtext 字段在初始拖入页面时，设置关联字段的固定值输入框，没有展示富文本样式",
+            "Date": f"2026-01-{i % 28 + 1:02d}",
+            "Content": "**[Worklog 1h]**" if i % 2 else "**[Comment]**",
+            "Comment": f"第 {i} 条记录：处理了多个富文本字段在特定场景下的显示和值清空问题"
+        }
+        for i in range(start, start + count)
+    ]
+
+
+def measure(name: str, operation: Callable[[str], None], story_ids: List[str], rounds: int) -> Dict[str, float]:
+    """对每个 story 执行 operation，返回延迟统计（毫秒）"""
+    latencies = []
+    started_at = time.perf_counter()
+    for _ in range(rounds):
+        for story_id in story_ids:
+            begin = time.perf_counter()
+            operation(story_id)
+            latencies.append((time.perf_counter() - begin) * 1000)
+    elapsed = time.perf_counter() - started_at
+    latencies.sort()
+    return {
+        "workload": name,
+        "ops": len(latencies),
+        "ops_per_second": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3)
+    }
+
+
+def run_backend(backend, prefix: str, story_ids: List[str], progress_size: int, rounds: int) -> List[Dict[str, float]]:
+    """在一个后端上执行所有负载"""
+    tags = ["delay", "risk"]
+    tags_str = json.dumps(tags)
+    fields_str = json.dumps(PROGRESS_FIELDS)
+
+    def keys(story_id: str) -> Dict[str, str]:
+        return {
+            "progress": f"{prefix}story:personal_progress:{story_id}",
+            "fingerprints": f"{prefix}story:personal_progress_fp:{story_id}",
+            "version": f"{prefix}story:version:{story_id}",
+            "tags": f"{prefix}story:tags:{story_id}"
+        }
+
+    def merge(story_id: str, records: List[Dict[str, str]]):
+        story_keys = keys(story_id)
+        backend.eval(MERGE_RECORDS_SCRIPT, [story_keys["progress"], story_keys["fingerprints"], story_keys["version"]],
+                     [fields_str] + [json.dumps(record, ensure_ascii=False) for record in records], idempotent=False)
+
+    # 准备个人进展数据（Redis 列表 + 指纹集合，与 parse_to_json 写入的结构相同，不计入耗时）
+    for story_id in story_ids:
+        merge(story_id, build_progress(story_id, progress_size))
+
+    merged = {story_id: progress_size for story_id in story_ids}
+
+    def tags_set(story_id: str):
+        backend.set(keys(story_id)["tags"], tags_str, 30 * 24 * 60 * 60)
+
+    def tags_get(story_id: str):
+        json.loads(backend.query("GET", keys(story_id)["tags"]))
+
+    def progress_merge(story_id: str):
+        merge(story_id, build_progress(story_id, 1, start=merged[story_id]))
+        merged[story_id] += 1
+
+    def progress_get(story_id: str):
+        json.loads(backend.eval(GET_JSON_MANY_SCRIPT, [keys(story_id)["progress"]], [])[0])
+
+    def description(story_id: str):
+        story_keys = keys(story_id)
+        backend.mget([story_keys["version"]])
+        for value in backend.eval(GET_JSON_MANY_SCRIPT, [story_keys["progress"], story_keys["tags"]], []):
+            json.loads(value)
+
+    results = [
+        measure("tags_set", tags_set, story_ids, rounds),
+        measure("tags_get", tags_get, story_ids, rounds),
+        measure("progress_merge", progress_merge, story_ids, rounds),
+        measure("progress_get", progress_get, story_ids, rounds),
+        measure("description", description, story_ids, rounds)
+    ]
+
+    # 清理测试数据
+    for story_id in story_ids:
+        for key in keys(story_id).values():
+            backend.query("DEL", key)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较 webdis 与 RESP 后端在 story:* 负载上的性能")
+    parser.add_argument("--stories", type=int, default=50, help="story 数量")
+    parser.add_argument("--progress-size", type=int, default=200, help="每个 story 的个人进展记录条数")
+    parser.add_argument("--rounds", type=int, default=5, help="每种负载重复的轮数")
+    parser.add_argument("--prefix", default="bench:", help="测试数据的 key 前缀")
+    parser.add_argument("--backends", default="webdis,resp", help="要测试的后端（逗号分隔）")
+    args = parser.parse_args()
+
+    story_ids = [f"BENCH-{i}" for i in range(args.stories)]
+    factories = {"webdis": WebdisBackend, "resp": RespBackend}
+
+    for name in [backend.strip() for backend in args.backends.split(",") if backend.strip()]:
+        if name == "resp" and redis_utils.redis is None:
+            print("跳过 resp：未安装 redis（pip install redis）")
+            continue
+        try:
+            backend = factories[name]()
+            results = run_backend(backend, args.prefix, story_ids, args.progress_size, args.rounds)
+        except Exception as e:
+            print(f"跳过 {name}：{e}")
+            continue
+
+        print(f"\n=== {name} ===")
+        print(f"{'workload':<16}{'ops':>8}{'ops/s':>12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for result in results:
+            print(f"{result['workload']:<16}{result['ops']:>8}{result['ops_per_second']:>12}"
+                  f"{result['mean_ms']:>10}{result['p50_ms']:>10}{result['p95_ms']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+按模型的熔断器与降级链
+gemini 返回 429 / MODEL_CAPACITY_EXHAUSTED 时打开该模型的熔断器，冷却期内的请求直接走降级链中的下一个模型，
+而不是每个请求都先耗完 gemini-cli 自带的重试退避再失败。
+"""
+import math
+import os
+import re
+import time
+from collections import deque
+from typing import Optional, Dict, Any, List
+
+
+# 降级链（逗号分隔，按优先级排列），请求某个模型时依次尝试它及其后面的模型
+GEMINI_MODEL_FALLBACK_CHAIN = [
+    model.strip()
+    for model in os.environ.get("GEMINI_MODEL_FALLBACK_CHAIN", "gemini-2.5-pro,gemini-2.5-flash").split(",")
+    if model.strip()
+]
+# 未指定模型时 gemini-cli 实际使用的模型
+GEMINI_DEFAULT_MODEL = os.environ.get("GEMINI_DEFAULT_MODEL", "gemini-2.5-pro")
+# 连续多少次容量错误后打开熔断器
+GEMINI_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("GEMINI_BREAKER_FAILURE_THRESHOLD", "1"))
+# 熔断器打开后的冷却时间（秒）
+GEMINI_BREAKER_COOLDOWN_SECONDS = float(os.environ.get("GEMINI_BREAKER_COOLDOWN_SECONDS", "120"))
+
+CAPACITY_ERROR_PATTERN = re.compile(
+    r"MODEL_CAPACITY_EXHAUSTED|RESOURCE_EXHAUSTED|status 429|\"code\":\s*429|rateLimitExceeded",
+    re.IGNORECASE
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def is_capacity_error(result: Dict[str, Any]) -> bool:
+    """
+    判断一次失败的 gemini 调用是否因容量不足（429）
+
+    成功的调用不算：gemini-cli 内部重试过的 429 也会出现在 stderr 中
+    （例如 "Attempt 1 failed with status 429. Retrying"），但最终已经拿到了结果。
+
+    Args:
+        result: GeminiCLIClient 返回的响应字典
+
+    Returns:
+        调用失败且出现容量错误返回 True
+    """
+    if result.get("success"):
+        return False
+    for field in ("error", "logs"):
+        text = result.get(field)
+        if text and CAPACITY_ERROR_PATTERN.search(text):
+            return True
+    return False
+
+
+class CircuitBreaker:
+    """单个模型的熔断器（closed -> open -> half_open -> closed）"""
+
+    def __init__(self, model: str, failure_threshold: int, cooldown_seconds: float):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        # 最近的状态变化记录
+        self.transitions: "deque[Dict[str, Any]]" = deque(maxlen=20)
+
+    def _transition(self, state: str, reason: str):
+        if state == self.state:
+            return
+        self.transitions.append({
+            "from": self.state,
+            "to": state,
+            "reason": reason,
+            "at": time.strftime("%Y-%m-%d %H:%M:%S")
+        })
+        print(f"模型 {self.model} 熔断器状态: {self.state} -> {state}（{reason}）")
+        self.state = state
+
+    def retry_in(self) -> float:
+        """距离冷却结束还有多少秒"""
+        if self.state != OPEN or self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown_seconds - time.monotonic())
+
+    def allow_request(self) -> bool:
+        """
+        当前是否允许向该模型发请求
+
+        冷却结束后进入 half_open，只放行一个试探请求
+        """
+        if self.state == OPEN and self.retry_in() <= 0:
+            self._transition(HALF_OPEN, "冷却结束，放行试探请求")
+            self._trial_in_flight = False
+
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def cancel_trial(self):
+        """放行的请求没有真正得到结果（被取消或被准入控制拒绝），允许下一个请求继续试探"""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        """记录一次没有容量错误的调用"""
+        self.failures = 0
+        self._trial_in_flight = False
+        self._transition(CLOSED, "调用成功")
+
+    def record_failure(self):
+        """记录一次容量错误"""
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._transition(OPEN, "检测到容量不足（429）")
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_in_seconds": round(self.retry_in(), 1),
+            "transitions": list(self.transitions)
+        }
+
+
+class ModelCircuitBreakers:
+    """管理所有模型的熔断器，并根据降级链挑选可用模型"""
+
+    def __init__(
+        self,
+        fallback_chain: Optional[List[str]] = None,
+        default_model: str = GEMINI_DEFAULT_MODEL,
+        failure_threshold: int = GEMINI_BREAKER_FAILURE_THRESHOLD,
+        cooldown_seconds: float = GEMINI_BREAKER_COOLDOWN_SECONDS
+    ):
+        """
+        初始化熔断器集合
+
+        Args:
+            fallback_chain: 降级链，默认读取环境变量 GEMINI_MODEL_FALLBACK_CHAIN
+            default_model: 未指定模型时 gemini-cli 使用的模型
+            failure_threshold: 连续多少次容量错误后打开熔断器
+            cooldown_seconds: 熔断器冷却时间（秒）
+        """
+        self.fallback_chain = fallback_chain if fallback_chain is not None else list(GEMINI_MODEL_FALLBACK_CHAIN)
+        self.default_model = default_model
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+        # 统计指标
+        self.fallbacks = 0
+        self.short_circuited = 0
+
+    def breaker(self, model: Optional[str]) -> CircuitBreaker:
+        """获取（必要时创建）指定模型的熔断器"""
+        name = model or self.default_model
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, self.failure_threshold, self.cooldown_seconds)
+            self._breakers[name] = breaker
+        return breaker
+
+    def candidates(self, model: Optional[str]) -> List[Optional[str]]:
+        """
+        获取请求某个模型时依次尝试的模型列表
+
+        Args:
+            model: 请求的模型，None 表示使用 gemini-cli 默认模型
+
+        Returns:
+            模型列表，第一个元素保持调用方传入的值（None 不会被改写成具体模型名）
+        """
+        name = model or self.default_model
+        if name in self.fallback_chain:
+            rest = self.fallback_chain[self.fallback_chain.index(name) + 1:]
+        else:
+            rest = []
+        return [model] + rest
+
+    def retry_after(self, models: List[Optional[str]]) -> int:
+        """所有候选模型都熔断时，最早恢复还需要的秒数"""
+        waits = [self.breaker(model).retry_in() for model in models]
+        return max(1, math.ceil(min(waits))) if waits else 1
+
+    def status(self) -> Dict[str, Any]:
+        """
+        获取所有熔断器的状态
+
+        Returns:
+            包含降级链、各模型熔断器状态和状态变化记录的字典
+        """
+        return {
+            "fallback_chain": self.fallback_chain,
+            "default_model": self.default_model,
+            "cooldown_seconds": self.cooldown_seconds,
+            "fallbacks": self.fallbacks,
+            "short_circuited": self.short_circuited,
+            "breakers": {name: breaker.status() for name, breaker in self._breakers.items()}
+        }
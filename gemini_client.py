@@ -1,52 +1,74 @@
+import asyncio
+import codecs
 import subprocess
-import json
+import threading
 import os
-from typing import Optional, Dict, Any, Tuple, List
+from contextlib import aclosing
+from typing import Optional, Dict, Any, Tuple, List, AsyncIterator, Union
 from pathlib import Path
 
+from admission_control import AdmissionController, AdmissionRejected, admission_controller, model_from_cmd, rejected_result
+from circuit_breaker import ModelCircuitBreakers, is_capacity_error
+from gemini_env import find_gemini_cli, get_enhanced_env, is_cli_available, invalidate as invalidate_gemini_env
+from gemini_worker_pool import GeminiWorkerPool, kill_process_tree, spawn_cli_process, terminate_process
+from mcp_registry import MCPServerRegistry
+from output_capture import CapturedOutput, OutputLimitExceeded, capture_stream, capture_stream_sync
+from response_cache import ResponseCache, request_fingerprint
+from single_flight import SingleFlight
+from stderr_classifier import GEMINI_STDERR_MAX_BYTES, INFO_KEYWORDS, cap_text, classify_stderr, is_info_message
+
+
+# 流式输出时每次从 stdout 读取的最大字节数
+STREAM_CHUNK_SIZE = 4096
+
 
 class GeminiCLIClient:
     """与本地 gemini-cli 交互的客户端"""
     
-    # 信息性消息的关键词（这些不应该被当作错误）
-    INFO_KEYWORDS = [
-        "Loaded cached credentials",
-        "Server",
-        "supports",
-        "Listening for changes",
-        "Listening for",
-        "resource updates",
-        "tool updates",
-    ]
+    # 信息性消息的关键词（这些不应该被当作错误），分类逻辑见 stderr_classifier
+    INFO_KEYWORDS = INFO_KEYWORDS
     
-    def __init__(self, cli_path: Optional[str] = None, settings_path: Optional[str] = None):
+    def __init__(self, cli_path: Optional[str] = None, settings_path: Optional[str] = None,
+                 worker_pool: Optional[GeminiWorkerPool] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 admission: Optional[AdmissionController] = None):
         """
         初始化 Gemini CLI 客户端
         
         Args:
             cli_path: gemini-cli 的路径，如果为 None 则尝试从 PATH 中查找
             settings_path: settings.json 的路径，默认为 ~/.gemini/settings.json
+            worker_pool: 预热进程池，默认按环境变量 GEMINI_POOL_SIZE 等配置创建
+            response_cache: 响应缓存，默认按环境变量 GEMINI_CACHE_MAX_ENTRIES 等配置创建
+            admission: 准入控制器，默认使用全局共享的 admission_controller
         """
-        self.cli_path = cli_path or self._find_gemini_cli()
+        self._cli_path = cli_path
         self.settings_path = settings_path or os.path.expanduser("~/.gemini/settings.json")
-        self._mcp_servers = self._load_mcp_servers()
+        # settings.json 变化时自动重新加载，无需重启服务
+        self.mcp_registry = MCPServerRegistry(self.settings_path)
+        self.worker_pool = worker_pool or GeminiWorkerPool()
+        self.response_cache = response_cache or ResponseCache()
+        # 合并并发中的相同请求，共享同一个子进程的结果
+        self.single_flight = SingleFlight()
+        self.admission = admission or admission_controller
+        # 按模型的熔断器，容量不足时切换到降级链中的下一个模型
+        self.breakers = ModelCircuitBreakers()
+        # 预热进程是按旧配置启动的，MCP 配置变化后需要全部重建
+        self.mcp_registry.subscribe(lambda old, new: self.worker_pool.drain())
     
     def _load_mcp_servers(self) -> Dict[str, Any]:
         """
-        从 settings.json 加载 MCP 服务器配置
+        立即从 settings.json 重新加载 MCP 服务器配置
         
         Returns:
             MCP 服务器配置字典
         """
-        try:
-            if os.path.exists(self.settings_path):
-                with open(self.settings_path, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-                    return settings.get("mcpServers", {})
-        except Exception as e:
-            # 如果读取失败，返回空字典
-            pass
-        return {}
+        return self.mcp_registry.reload()
+    
+    @property
+    def _mcp_servers(self) -> Dict[str, Any]:
+        """当前的 MCP 服务器配置（按 settings.json 的 mtime 自动刷新）"""
+        return self.mcp_registry.servers()
     
     def get_available_mcp_servers(self) -> List[str]:
         """
@@ -67,14 +89,11 @@ class GeminiCLIClient:
         Returns:
             如果是信息性消息返回 True，否则返回 False
         """
-        if not message:
-            return False
-        message_lower = message.lower()
-        return any(keyword.lower() in message_lower for keyword in self.INFO_KEYWORDS)
+        return is_info_message(message)
     
-    def _parse_stderr(self, stderr: str) -> Tuple[Optional[str], Optional[str]]:
+    def _parse_stderr(self, stderr: Union[str, CapturedOutput, None]) -> Tuple[Optional[str], Optional[str]]:
         """
-        解析 stderr 输出，区分错误和信息性消息
+        解析 stderr 输出，区分错误和信息性消息（单次遍历、重复行合并、按字节预算截断）
         
         Args:
             stderr: stderr 输出内容
@@ -84,119 +103,44 @@ class GeminiCLIClient:
             - error_message: 真正的错误消息，如果没有错误则为 None
             - info_logs: 信息性日志，如果没有则为 None
         """
-        if not stderr or not stderr.strip():
-            return None, None
-        
-        lines = stderr.strip().split('\n')
-        error_lines = []
-        info_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            
-            if self._is_info_message(line):
-                info_lines.append(line)
-            else:
-                # 检查是否是真正的错误消息
-                # 通常错误消息包含 "error", "failed", "exception" 等关键词
-                error_indicators = ['error', 'failed', 'exception', 'fatal', 'cannot', "can't"]
-                if any(indicator in line.lower() for indicator in error_indicators):
-                    error_lines.append(line)
-                else:
-                    # 不确定的消息，默认当作信息性消息
-                    info_lines.append(line)
-        
-        error_msg = '\n'.join(error_lines) if error_lines else None
-        info_logs = '\n'.join(info_lines) if info_lines else None
-        
-        return error_msg, info_logs
+        return classify_stderr(stderr)
     
     def _get_enhanced_env(self) -> Dict[str, str]:
         """
-        获取增强的环境变量，确保包含必要的 PATH 路径
+        获取增强的环境变量，确保包含必要的 PATH 路径（进程内缓存，见 gemini_env）
         
         Returns:
             增强后的环境变量字典
         """
-        env = os.environ.copy()
-        # 确保 PATH 包含必要的路径
-        path_parts = env.get("PATH", "").split(os.pathsep)
-        important_paths = [
-            "/opt/homebrew/bin",
-            "/usr/local/bin",
-            "/Users/ChuanHuang/.orbstack/bin",  # Docker (OrbStack)
-            os.path.expanduser("~/.orbstack/bin"),
-        ]
-        for path in important_paths:
-            if path and os.path.exists(path) and path not in path_parts:
-                path_parts.insert(0, path)
-        env["PATH"] = os.pathsep.join(path_parts)
-        return env
+        return get_enhanced_env()
     
     def _find_gemini_cli(self) -> str:
-        """尝试查找 gemini-cli 可执行文件"""
-        # 常见的可能路径（按优先级排序）
-        possible_paths = [
-            # 直接使用绝对路径（最可靠）
-            "/opt/homebrew/bin/gemini",  # Homebrew on Apple Silicon
-            "/usr/local/bin/gemini",  # Homebrew on Intel Mac
-            "/opt/homebrew/bin/gemini-cli",
-            "/usr/local/bin/gemini-cli",
-            # 相对路径（需要 PATH）
-            "gemini-cli",
-            "gemini",
-            # 用户目录
-            os.path.expanduser("~/.local/bin/gemini-cli"),
-            os.path.expanduser("~/bin/gemini-cli"),
-            os.path.expanduser("~/.local/bin/gemini"),
-            os.path.expanduser("~/bin/gemini"),
-        ]
-        
-        for path in possible_paths:
-            try:
-                if os.path.isabs(path):
-                    if os.path.exists(path) and os.access(path, os.X_OK):
-                        return path
-                else:
-                    # 使用 which 查找命令
-                    result = subprocess.run(
-                        ["which", path],
-                        capture_output=True,
-                        text=True,
-                        timeout=2
-                    )
-                    if result.returncode == 0:
-                        found_path = result.stdout.strip()
-                        if found_path and os.access(found_path, os.X_OK):
-                            return found_path
-            except:
-                continue
-        
-        # 默认返回 gemini-cli，让调用时再处理错误
-        return "gemini-cli"
+        """尝试查找 gemini-cli 可执行文件（进程内缓存，见 gemini_env）"""
+        return find_gemini_cli()
+    
+    @property
+    def cli_path(self) -> str:
+        """gemini-cli 路径：构造时未指定则在第一次使用时查找"""
+        return self._cli_path or self._find_gemini_cli()
     
-    def is_available(self) -> Dict[str, Any]:
+    @cli_path.setter
+    def cli_path(self, value: Optional[str]):
+        self._cli_path = value
+    
+    def is_available(self, refresh: bool = False) -> Dict[str, Any]:
         """
-        检查 gemini-cli 是否可用（不执行实际命令）
+        检查 gemini-cli 是否可用（不执行实际命令，也不 fork 子进程）
+        
+        Args:
+            refresh: 是否清空缓存，重新查找 gemini-cli 并重建环境变量
         
         Returns:
             包含检查结果的字典
         """
         try:
-            # 检查文件是否存在且可执行
-            if os.path.isabs(self.cli_path):
-                exists = os.path.exists(self.cli_path) and os.access(self.cli_path, os.X_OK)
-            else:
-                # 尝试查找命令
-                result = subprocess.run(
-                    ["which", self.cli_path],
-                    capture_output=True,
-                    text=True,
-                    timeout=2
-                )
-                exists = result.returncode == 0
+            if refresh:
+                invalidate_gemini_env()
+            exists = is_cli_available(self.cli_path)
             
             return {
                 "available": exists,
@@ -225,88 +169,24 @@ class GeminiCLIClient:
             包含响应结果的字典
         """
         try:
-            # 构建命令
-            cmd = [self.cli_path]
-            
-            # 添加模型参数（如果提供）
-            if model:
-                cmd.extend(["--model", model])
-            
-            # 添加 MCP 服务器参数
-            if mcp_servers is not None:
-                # 如果指定了 MCP 服务器，使用 --allowed-mcp-server-names
-                for server_name in mcp_servers:
-                    cmd.extend(["--allowed-mcp-server-names", server_name])
-            # 如果没有指定，gemini 会自动使用 settings.json 中配置的所有服务器
-            
-            # 添加审批模式参数（如果提供）
-            approval_mode = kwargs.pop("approval_mode", None)
-            if approval_mode:
-                cmd.extend(["--approval-mode", approval_mode])
-            
-            # 添加其他参数
-            for key, value in kwargs.items():
-                if value is not None:
-                    # 跳过 mcp_servers，因为已经单独处理了
-                    if key == "mcp_servers":
-                        continue
-                    cmd.extend([f"--{key.replace('_', '-')}", str(value)])
+            cmd = self._build_chat_cmd(model, mcp_servers, **kwargs)
             
             # 执行命令并传递消息
-            # 使用 run 而不是 Popen，这样更容易控制超时
             # 使用增强的环境变量，确保包含 Docker 等必要路径
             env = self._get_enhanced_env()
             
-            process = subprocess.run(
-                cmd,
-                input=message,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                cwd=os.getcwd(),
-                env=env,  # 使用增强的环境变量
-                timeout=300
-            )
-            
-            stdout = process.stdout
-            stderr = process.stderr
-            
-            # 解析 stderr，区分错误和信息性消息
-            error_msg, info_logs = self._parse_stderr(stderr)
-            
-            # 如果返回码不为0，即使没有明确的错误消息，也认为有错误
-            if process.returncode != 0 and not error_msg:
-                error_msg = stderr.strip() if stderr else "Command failed with non-zero exit code"
-            
-            return {
-                "success": process.returncode == 0,
-                "response": stdout.strip() if stdout else "",
-                "error": error_msg,
-                "logs": info_logs,  # 信息性日志
-                "return_code": process.returncode
-            }
+            returncode, stdout, stderr = run_cli_sync(cmd, message, env, os.getcwd(), timeout=300)
+            with stderr:
+                return self._build_result(returncode, stdout, stderr)
             
         except subprocess.TimeoutExpired:
-            return {
-                "success": False,
-                "response": "",
-                "error": "Command timeout after 300 seconds",
-                "return_code": -1
-            }
+            return self._timeout_result()
+        except OutputLimitExceeded as e:
+            return self._output_limit_result(e)
         except FileNotFoundError:
-            return {
-                "success": False,
-                "response": "",
-                "error": f"gemini-cli not found at: {self.cli_path}. Please ensure gemini-cli is installed and in your PATH.",
-                "return_code": -1
-            }
+            return self._not_found_result()
         except Exception as e:
-            return {
-                "success": False,
-                "response": "",
-                "error": str(e),
-                "return_code": -1
-            }
+            return self._exception_result(e)
     
     def chat_with_args(self, message: str, args: list) -> Dict[str, Any]:
         """
@@ -325,56 +205,619 @@ class GeminiCLIClient:
             # 使用增强的环境变量，确保包含 Docker 等必要路径
             env = self._get_enhanced_env()
             
-            process = subprocess.run(
-                cmd,
-                input=message,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                cwd=os.getcwd(),
-                env=env,  # 使用增强的环境变量
-                timeout=300
-            )
-            
-            stdout = process.stdout
-            stderr = process.stderr
+            returncode, stdout, stderr = run_cli_sync(cmd, message, env, os.getcwd(), timeout=300)
+            with stderr:
+                return self._build_result(returncode, stdout, stderr)
             
-            # 解析 stderr，区分错误和信息性消息
-            error_msg, info_logs = self._parse_stderr(stderr)
+        except subprocess.TimeoutExpired:
+            return self._timeout_result()
+        except OutputLimitExceeded as e:
+            return self._output_limit_result(e)
+        except FileNotFoundError:
+            return self._not_found_result()
+        except Exception as e:
+            return self._exception_result(e)
+    
+    async def achat(self, message: str, model: Optional[str] = None,
+                    mcp_servers: Optional[List[str]] = None, cache_ttl: Optional[int] = None,
+                    force: bool = False, **kwargs) -> Dict[str, Any]:
+        """
+        chat 的异步版本：基于 asyncio 子进程执行，不阻塞事件循环
+        
+        Args:
+            message: 要发送的消息
+            model: 模型名称（可选）
+            mcp_servers: 要使用的 MCP 服务器名称列表（可选）
+            cache_ttl: 响应缓存时间（秒），为 None 时不使用缓存
+            force: 是否跳过缓存强制调用 gemini（结果仍会写入缓存）
+            **kwargs: 其他参数
+        
+        Returns:
+            与 chat 相同结构的响应字典，命中缓存时额外带有 "cached": True
+        """
+        try:
+            cmd = self._build_chat_cmd(model, mcp_servers, **kwargs)
             
-            # 如果返回码不为0，即使没有明确的错误消息，也认为有错误
-            if process.returncode != 0 and not error_msg:
-                error_msg = stderr.strip() if stderr else "Command failed with non-zero exit code"
+            fingerprint = request_fingerprint(message, cmd)
+            if cache_ttl:
+                if force:
+                    self.response_cache.record_bypass()
+                else:
+                    cached = await self.response_cache.get(fingerprint)
+                    if cached is not None:
+                        cached["cached"] = True
+                        return cached
             
-            return {
-                "success": process.returncode == 0,
-                "response": stdout.strip() if stdout else "",
-                "error": error_msg,
-                "logs": info_logs,  # 信息性日志
-                "return_code": process.returncode
-            }
+            async def run_and_cache() -> Dict[str, Any]:
+                result = await self._arun_with_fallback(message, model, mcp_servers, **kwargs)
+                if cache_ttl and result["success"]:
+                    await self.response_cache.set(fingerprint, result, cache_ttl)
+                return result
             
-        except subprocess.TimeoutExpired:
-            return {
-                "success": False,
-                "response": "",
-                "error": "Command timeout after 300 seconds",
-                "return_code": -1
-            }
+            # 相同 prompt 的并发请求只启动一个 gemini 进程，各自拿到结果的副本
+            return dict(await self.single_flight.do(fingerprint, run_and_cache))
+        except Exception as e:
+            return self._exception_result(e)
+    
+    async def achat_with_args(self, message: str, args: list) -> Dict[str, Any]:
+        """
+        chat_with_args 的异步版本
+        
+        Args:
+            message: 要发送的消息
+            args: 额外的命令行参数列表
+        
+        Returns:
+            与 chat_with_args 相同结构的响应字典
+        """
+        try:
+            return await self._arun([self.cli_path] + args, message)
+        except Exception as e:
+            return self._exception_result(e)
+    
+    async def astream_chat(self, message: str, model: Optional[str] = None,
+                           mcp_servers: Optional[List[str]] = None, cache_ttl: Optional[int] = None,
+                           force: bool = False, **kwargs) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        流式版本的 achat：gemini 输出一段就产出一段
+        
+        Args:
+            与 achat 相同
+        
+        Yields:
+            ("chunk", 文本片段) 若干次，最后是一次 ("done", 响应字典)；
+            响应字典与 achat 的结构相同，其中 error/logs 由 _parse_stderr 区分
+        """
+        try:
+            cmd = self._build_chat_cmd(model, mcp_servers, **kwargs)
+        except Exception as e:
+            yield "done", self._exception_result(e)
+            return
+        
+        fingerprint = request_fingerprint(message, cmd)
+        if cache_ttl:
+            if force:
+                self.response_cache.record_bypass()
+            else:
+                cached = await self.response_cache.get(fingerprint)
+                if cached is not None:
+                    cached["cached"] = True
+                    yield "chunk", cached["response"]
+                    yield "done", cached
+                    return
+        
+        # 流式输出无法中途切换模型，只在开始前挑选一个未熔断的模型
+        candidates = self.breakers.candidates(model)
+        selected_index = next(
+            (index for index, candidate in enumerate(candidates)
+             if self.breakers.breaker(candidate).allow_request()),
+            None
+        )
+        if selected_index is None:
+            self.breakers.short_circuited += 1
+            yield "done", self._capacity_exhausted_result(candidates)
+            return
+        selected = candidates[selected_index]
+        if selected != model:
+            self.breakers.fallbacks += 1
+            cmd = self._build_chat_cmd(selected, mcp_servers, **kwargs)
+        breaker = self.breakers.breaker(selected)
+        
+        # 使用 aclosing 保证调用方提前关闭时，内部生成器也会立即清理子进程
+        try:
+            async with aclosing(self._astream(cmd, message, use_pool=True)) as events:
+                async for event, payload in events:
+                    if event == "done":
+                        self._record_breaker_outcome(breaker, payload)
+                        if selected != model:
+                            payload["model"] = selected
+                        if cache_ttl and payload["success"]:
+                            await self.response_cache.set(fingerprint, payload, cache_ttl)
+                    yield event, payload
+        finally:
+            breaker.cancel_trial()
+    
+    async def astream_chat_with_args(self, message: str, args: list) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        流式版本的 achat_with_args
+        
+        Yields:
+            与 astream_chat 相同
+        """
+        async with aclosing(self._astream([self.cli_path] + args, message)) as events:
+            async for event, payload in events:
+                yield event, payload
+    
+    async def _astream(self, cmd: List[str], message: str, timeout: int = 300,
+                       use_pool: bool = False) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        以异步子进程方式执行命令，边读 stdout 边产出文本片段
+        
+        Yields:
+            ("chunk", 文本片段) 若干次，最后是一次 ("done", 响应字典)
+        """
+        # 完整输出只用于最终的 done 事件（以及写入缓存），超过阈值后转存到临时文件
+        stdout = CapturedOutput("stdout")
+        stderr = CapturedOutput("stderr")
+        try:
+            async with self.admission.slot(model_from_cmd(cmd)):
+                env = self._get_enhanced_env()
+                if use_pool:
+                    process = await self.worker_pool.lease(cmd, env, os.getcwd())
+                else:
+                    process = await spawn_cli_process(cmd, env, os.getcwd())
+                
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + timeout
+                stderr_task = asyncio.ensure_future(capture_or_kill(process, process.stderr, stderr))
+                try:
+                    process.stdin.write(message.encode("utf-8"))
+                    await process.stdin.drain()
+                    process.stdin.close()
+                    
+                    # 按增量方式解码，避免多字节字符被切断
+                    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+                    while True:
+                        data = await asyncio.wait_for(
+                            process.stdout.read(STREAM_CHUNK_SIZE),
+                            timeout=max(deadline - loop.time(), 0)
+                        )
+                        stdout.write(data)
+                        text = decoder.decode(data, final=not data)
+                        if text:
+                            yield "chunk", text
+                        if not data:
+                            break
+                    
+                    await asyncio.wait_for(stderr_task, timeout=max(deadline - loop.time(), 0))
+                    returncode = await asyncio.wait_for(process.wait(), timeout=max(deadline - loop.time(), 0))
+                finally:
+                    # 超时、出错或客户端断开时，确保子进程不会残留
+                    if process.returncode is None:
+                        # 客户端断开时这里的每个 await 都可能再次被取消，reap_process 会先同步结束进程组，
+                        # 并等进程退出后才离开准入名额
+                        await reap_process(process, stderr_task)
+            result = self._build_result(returncode, stdout.text(), stderr)
+        except AdmissionRejected as e:
+            result = rejected_result(e)
+        except asyncio.TimeoutError:
+            result = self._timeout_result(timeout)
         except FileNotFoundError:
-            return {
-                "success": False,
-                "response": "",
-                "error": f"gemini-cli not found at: {self.cli_path}. Please ensure gemini-cli is installed and in your PATH.",
-                "return_code": -1
-            }
+            result = self._not_found_result()
+        except OutputLimitExceeded as e:
+            result = self._output_limit_result(e)
         except Exception as e:
-            return {
-                "success": False,
-                "response": "",
-                "error": str(e),
-                "return_code": -1
-            }
+            result = self._exception_result(e)
+        finally:
+            stdout.close()
+            stderr.close()
+        
+        yield "done", result
+    
+    async def _arun_with_fallback(self, message: str, model: Optional[str],
+                                  mcp_servers: Optional[List[str]], **kwargs) -> Dict[str, Any]:
+        """
+        按降级链依次尝试模型：跳过熔断中的模型，遇到容量不足（429）时换下一个
+        
+        Returns:
+            响应字典；使用了降级模型时额外带有 "model" 字段，
+            所有候选模型都不可用时返回 429 和 Retry-After
+        """
+        candidates = self.breakers.candidates(model)
+        last_result = None
+        for candidate in candidates:
+            breaker = self.breakers.breaker(candidate)
+            if not breaker.allow_request():
+                continue
+            if candidate != model:
+                self.breakers.fallbacks += 1
+            
+            try:
+                cmd = self._build_chat_cmd(candidate, mcp_servers, **kwargs)
+                result = await self._arun(cmd, message, use_pool=True)
+            finally:
+                breaker.cancel_trial()
+            
+            capacity_error = self._record_breaker_outcome(breaker, result)
+            if candidate != model:
+                result["model"] = candidate
+            if not capacity_error:
+                return result
+            last_result = result
+        
+        if last_result is None:
+            self.breakers.short_circuited += 1
+            return self._capacity_exhausted_result(candidates)
+        
+        # 所有候选模型都容量不足：保留最后一次的错误信息，并告诉客户端何时重试
+        last_result["status_code"] = 429
+        last_result["headers"] = {"Retry-After": str(self.breakers.retry_after(candidates))}
+        return last_result
+    
+    def _record_breaker_outcome(self, breaker, result: Dict[str, Any]) -> bool:
+        """
+        根据调用结果更新熔断器
+        
+        Returns:
+            调用是否因容量不足而失败
+        """
+        if is_capacity_error(result):
+            breaker.record_failure()
+            return True
+        # 被准入控制拒绝的请求没有真正调用模型，不影响熔断器
+        if result.get("status_code") is None:
+            breaker.record_success()
+        return False
+    
+    def _capacity_exhausted_result(self, candidates: List[Optional[str]]) -> Dict[str, Any]:
+        """所有候选模型都在熔断中时的响应字典（429）"""
+        names = ", ".join(candidate or self.breakers.default_model for candidate in candidates)
+        return rejected_result(AdmissionRejected(
+            f"模型容量不足，熔断中: {names}",
+            status_code=429,
+            retry_after=self.breakers.retry_after(candidates)
+        ))
+    
+    async def _arun(self, cmd: List[str], message: str, timeout: int = 300,
+                    use_pool: bool = False) -> Dict[str, Any]:
+        """
+        以异步子进程方式执行命令并构建响应字典
+        
+        Args:
+            cmd: 完整命令列表
+            message: 通过 stdin 传递的消息
+            timeout: 超时时间（秒）
+            use_pool: 是否从预热进程池租用进程
+        
+        Returns:
+            响应字典
+        """
+        try:
+            # 按模型限制并发，排队已满或超时会直接拒绝
+            async with self.admission.slot(model_from_cmd(cmd)):
+                env = self._get_enhanced_env()
+                if use_pool:
+                    process = await self.worker_pool.lease(cmd, env, os.getcwd())
+                else:
+                    process = await spawn_cli_process(cmd, env, os.getcwd())
+                returncode, stdout, stderr = await communicate_cli(process, message, timeout)
+        except AdmissionRejected as e:
+            return rejected_result(e)
+        except asyncio.TimeoutError:
+            return self._timeout_result(timeout)
+        except FileNotFoundError:
+            return self._not_found_result()
+        except OutputLimitExceeded as e:
+            return self._output_limit_result(e)
+        with stderr:
+            return self._build_result(returncode, stdout, stderr)
+    
+    def _build_chat_cmd(self, model: Optional[str] = None,
+                        mcp_servers: Optional[List[str]] = None, **kwargs) -> List[str]:
+        """
+        根据 chat 参数构建 gemini-cli 命令
+        
+        Returns:
+            命令列表
+        """
+        cmd = [self.cli_path]
+        
+        # 添加模型参数（如果提供）
+        if model:
+            cmd.extend(["--model", model])
+        
+        # 添加 MCP 服务器参数
+        if mcp_servers is not None:
+            # 如果指定了 MCP 服务器，使用 --allowed-mcp-server-names
+            for server_name in mcp_servers:
+                cmd.extend(["--allowed-mcp-server-names", server_name])
+        # 如果没有指定，gemini 会自动使用 settings.json 中配置的所有服务器
+        
+        # 添加审批模式参数（如果提供）
+        approval_mode = kwargs.pop("approval_mode", None)
+        if approval_mode:
+            cmd.extend(["--approval-mode", approval_mode])
+        
+        # 添加其他参数
+        for key, value in kwargs.items():
+            if value is not None:
+                # 跳过 mcp_servers，因为已经单独处理了
+                if key == "mcp_servers":
+                    continue
+                cmd.extend([f"--{key.replace('_', '-')}", str(value)])
+        
+        return cmd
+    
+    def _build_result(self, returncode: int, stdout: Optional[str],
+                      stderr: Union[str, CapturedOutput, None]) -> Dict[str, Any]:
+        """
+        根据进程退出码和输出构建响应字典
+        
+        Args:
+            returncode: 进程退出码
+            stdout: 标准输出
+            stderr: 标准错误（字符串，或逐行读取的 CapturedOutput）
+        
+        Returns:
+            包含响应结果的字典
+        """
+        # 解析 stderr，区分错误和信息性消息
+        error_msg, info_logs = self._parse_stderr(stderr)
+        
+        # 如果返回码不为0，即使没有明确的错误消息，也认为有错误
+        if returncode != 0 and not error_msg:
+            error_msg = stderr_preview(stderr) or "Command failed with non-zero exit code"
+        
+        return {
+            "success": returncode == 0,
+            "response": stdout.strip() if stdout else "",
+            "error": error_msg,
+            "logs": info_logs,  # 信息性日志
+            "return_code": returncode
+        }
+    
+    def _timeout_result(self, timeout: int = 300) -> Dict[str, Any]:
+        """超时时的响应字典"""
+        return {
+            "success": False,
+            "response": "",
+            "error": f"Command timeout after {timeout} seconds",
+            "return_code": -1
+        }
+    
+    def _not_found_result(self) -> Dict[str, Any]:
+        """找不到 gemini-cli 时的响应字典"""
+        return {
+            "success": False,
+            "response": "",
+            "error": f"gemini-cli not found at: {self.cli_path}. Please ensure gemini-cli is installed and in your PATH.",
+            "return_code": -1
+        }
+    
+    def _output_limit_result(self, e: OutputLimitExceeded) -> Dict[str, Any]:
+        """输出超过硬上限（进程已被结束）时的响应字典"""
+        return {
+            "success": False,
+            "response": "",
+            "error": str(e),
+            "return_code": -1
+        }
+    
+    def _exception_result(self, e: Exception) -> Dict[str, Any]:
+        """其他异常时的响应字典"""
+        return {
+            "success": False,
+            "response": "",
+            "error": str(e),
+            "return_code": -1
+        }
+
+
+async def run_cli_async(cmd: List[str], message: str, env: Dict[str, str],
+                        cwd, timeout: int = 300) -> Tuple[int, str, CapturedOutput]:
+    """
+    使用 asyncio 子进程执行 gemini 命令，等待期间不阻塞事件循环
+    
+    Args:
+        cmd: 完整命令列表
+        message: 通过 stdin 传递的消息
+        env: 环境变量
+        cwd: 工作目录
+        timeout: 超时时间（秒），超时会杀掉子进程并抛出 asyncio.TimeoutError
+    
+    Returns:
+        (return_code, stdout, stderr) 元组，stderr 由调用方读取后关闭
+    """
+    process = await spawn_cli_process(cmd, env, cwd)
+    return await communicate_cli(process, message, timeout)
+
+
+async def communicate_cli(process: asyncio.subprocess.Process, message: str,
+                          timeout: int = 300) -> Tuple[int, str, CapturedOutput]:
+    """
+    向已启动的 gemini 进程写入消息并等待其输出
+    
+    stdout / stderr 按块读入 CapturedOutput（超过阈值转存到临时文件），
+    任一输出超过硬上限时结束整个进程组并抛出 OutputLimitExceeded。
+    
+    Args:
+        process: 已启动的 asyncio 子进程
+        message: 通过 stdin 传递的消息
+        timeout: 超时时间（秒），超时会杀掉子进程并抛出 asyncio.TimeoutError
+    
+    Returns:
+        (return_code, stdout, stderr) 元组，stderr 由调用方读取后关闭
+    """
+    stdout = CapturedOutput("stdout")
+    stderr = CapturedOutput("stderr")
+    
+    async def feed_stdin():
+        try:
+            process.stdin.write(message.encode("utf-8"))
+            await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # 进程提前退出（例如参数错误），错误信息在 stderr 中
+            pass
+        finally:
+            process.stdin.close()
+    
+    async def run() -> int:
+        # 等所有读取结束后再处理异常，避免与 terminate_process 同时读取管道
+        outcomes = await asyncio.gather(
+            feed_stdin(),
+            capture_or_kill(process, process.stdout, stdout),
+            capture_or_kill(process, process.stderr, stderr),
+            return_exceptions=True
+        )
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+        return await process.wait()
+    
+    try:
+        returncode = await asyncio.wait_for(run(), timeout=timeout)
+        return returncode, stdout.text(), stderr
+    except BaseException:
+        # 超时或请求被取消（例如客户端断开）时，结束整个进程组，确保子进程不会残留
+        stderr.close()
+        if process.returncode is None:
+            await reap_process(process)
+        raise
+    finally:
+        stdout.close()
+
+
+async def capture_or_kill(process: asyncio.subprocess.Process, stream: asyncio.StreamReader,
+                          capture: CapturedOutput):
+    """读取一个输出流，超过硬上限时立即结束整个进程组（另一个流随之结束）"""
+    try:
+        await capture_stream(stream, capture)
+    except OutputLimitExceeded:
+        kill_process_tree(process)
+        raise
+
+
+async def reap_process(process: asyncio.subprocess.Process, *readers: asyncio.Future):
+    """
+    结束进程组并等待进程退出，期间再次被取消也会等到进程退出后才把取消抛出
+
+    调用方在准入名额内调用，这样名额只会在进程确实退出后才归还，
+    不会因为客户端断开而让残留的进程绕过并发上限。
+
+    Args:
+        process: spawn_cli_process 启动的子进程
+        readers: 仍在读取该进程输出的任务，会先被取消
+    """
+    kill_process_tree(process)
+    for reader in readers:
+        if not reader.done():
+            reader.cancel()
+
+    async def reap():
+        await asyncio.gather(*readers, return_exceptions=True)
+        await terminate_process(process)
+
+    reaper = asyncio.ensure_future(reap())
+    cancelled = False
+    while not reaper.done():
+        try:
+            await asyncio.shield(reaper)
+        except asyncio.CancelledError:
+            cancelled = True
+    if cancelled:
+        raise asyncio.CancelledError()
+    reaper.result()
+
+
+def run_cli_sync(cmd: List[str], message: str, env: Dict[str, str],
+                 cwd, timeout: int = 300) -> Tuple[int, str, CapturedOutput]:
+    """
+    同步执行 gemini 命令（用于 chat / chat_with_args），输出捕获方式与 communicate_cli 相同
+    
+    Args:
+        cmd: 完整命令列表
+        message: 通过 stdin 传递的消息
+        env: 环境变量
+        cwd: 工作目录
+        timeout: 超时时间（秒），超时会杀掉子进程并抛出 subprocess.TimeoutExpired
+    
+    Returns:
+        (return_code, stdout, stderr) 元组，stderr 由调用方读取后关闭
+    
+    Raises:
+        OutputLimitExceeded: 输出超过硬上限（进程已被结束）
+    """
+    process = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=cwd,
+        env=env,
+        start_new_session=hasattr(os, "killpg")
+    )
+    stdout = CapturedOutput("stdout")
+    stderr = CapturedOutput("stderr")
+    errors: List[OutputLimitExceeded] = []
+    
+    def reader(stream, capture: CapturedOutput):
+        try:
+            capture_stream_sync(stream, capture)
+        except OutputLimitExceeded as e:
+            errors.append(e)
+            kill_process_tree(process)
+        finally:
+            stream.close()
+    
+    threads = [
+        threading.Thread(target=reader, args=(process.stdout, stdout), daemon=True),
+        threading.Thread(target=reader, args=(process.stderr, stderr), daemon=True)
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        try:
+            process.stdin.write(message.encode("utf-8"))
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+        
+        process.wait(timeout=timeout)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return process.returncode, stdout.text(), stderr
+    except BaseException:
+        if process.poll() is None:
+            kill_process_tree(process)
+            process.wait()
+        for thread in threads:
+            if thread.is_alive():
+                thread.join()
+        stderr.close()
+        raise
+    finally:
+        stdout.close()
+
+
+def stderr_preview(stderr: Union[str, CapturedOutput, None]) -> Optional[str]:
+    """
+    取 stderr 开头不超过字节预算的部分（没有分类出错误、但进程非零退出时作为 error 返回）
+    
+    Returns:
+        截断后的文本，stderr 为空时返回 None
+    """
+    if not stderr:
+        return None
+    if isinstance(stderr, CapturedOutput):
+        # 多读 1 字节，让 cap_text 知道需要标注截断
+        stderr = stderr.text(GEMINI_STDERR_MAX_BYTES + 1)
+    return cap_text(stderr) or None
 
 
 # 全局客户端实例
@@ -0,0 +1,134 @@
+"""
+gemini-cli 可执行文件与运行环境的解析（进程内缓存）
+GeminiCLIClient 与 GeminiSessionSimple 共用这里的结果：第一次用到时才解析，之后直接复用，
+只有调用 invalidate() 后才会重新解析。查找命令使用 shutil.which，不再 fork `which` 子进程。
+"""
+import os
+import shutil
+import threading
+from typing import Optional, Dict, Tuple
+
+
+# 查找 gemini-cli 的候选路径（按优先级排序）
+GEMINI_CLI_CANDIDATES = [
+    # 直接使用绝对路径（最可靠）
+    "/opt/homebrew/bin/gemini",  # Homebrew on Apple Silicon
+    "/usr/local/bin/gemini",  # Homebrew on Intel Mac
+    "/opt/homebrew/bin/gemini-cli",
+    "/usr/local/bin/gemini-cli",
+    # 相对路径（需要 PATH）
+    "gemini-cli",
+    "gemini",
+    # 用户目录
+    os.path.expanduser("~/.local/bin/gemini-cli"),
+    os.path.expanduser("~/bin/gemini-cli"),
+    os.path.expanduser("~/.local/bin/gemini"),
+    os.path.expanduser("~/bin/gemini"),
+]
+
+# 需要确保出现在 PATH 中的目录
+IMPORTANT_PATHS = [
+    "/opt/homebrew/bin",
+    "/usr/local/bin",
+    "/Users/ChuanHuang/.orbstack/bin",  # Docker (OrbStack)
+    os.path.expanduser("~/.orbstack/bin"),
+]
+
+_lock = threading.RLock()
+_cli_path: Optional[str] = None
+_env_cache: Dict[Tuple[Tuple[str, str], ...], Dict[str, str]] = {}
+_availability_cache: Dict[str, bool] = {}
+
+
+def _is_executable(path: str) -> bool:
+    return os.path.exists(path) and os.access(path, os.X_OK)
+
+
+def find_gemini_cli() -> str:
+    """
+    查找 gemini-cli 可执行文件（结果在进程内缓存）
+
+    Returns:
+        可执行文件路径；找不到时返回 "gemini-cli"，让调用时再处理错误
+    """
+    global _cli_path
+    if _cli_path is not None:
+        return _cli_path
+
+    with _lock:
+        if _cli_path is None:
+            search_path = get_enhanced_env().get("PATH")
+            resolved = "gemini-cli"
+            for path in GEMINI_CLI_CANDIDATES:
+                if os.path.isabs(path):
+                    if _is_executable(path):
+                        resolved = path
+                        break
+                else:
+                    found_path = shutil.which(path, path=search_path)
+                    if found_path:
+                        resolved = found_path
+                        break
+            _cli_path = resolved
+    return _cli_path
+
+
+def is_cli_available(cli_path: str) -> bool:
+    """
+    检查 gemini-cli 是否存在且可执行（结果在进程内缓存）
+
+    Args:
+        cli_path: 绝对路径或命令名
+
+    Returns:
+        可用返回 True
+    """
+    available = _availability_cache.get(cli_path)
+    if available is None:
+        if os.path.isabs(cli_path):
+            available = _is_executable(cli_path)
+        else:
+            available = shutil.which(cli_path, path=get_enhanced_env().get("PATH")) is not None
+        _availability_cache[cli_path] = available
+    return available
+
+
+def get_enhanced_env(**defaults: str) -> Dict[str, str]:
+    """
+    获取增强的环境变量（结果在进程内缓存），确保 PATH 包含必要的目录
+
+    返回的是共享的字典，只用于传给子进程，调用方不要修改它。
+
+    Args:
+        **defaults: 环境中没有时需要补上的变量，例如 GOOGLE_CLOUD_PROJECT="codeassist-prod"
+
+    Returns:
+        环境变量字典
+    """
+    key = tuple(sorted(defaults.items()))
+    env = _env_cache.get(key)
+    if env is not None:
+        return env
+
+    with _lock:
+        env = _env_cache.get(key)
+        if env is None:
+            env = os.environ.copy()
+            path_parts = env.get("PATH", "").split(os.pathsep)
+            for path in IMPORTANT_PATHS:
+                if path and os.path.exists(path) and path not in path_parts:
+                    path_parts.insert(0, path)
+            env["PATH"] = os.pathsep.join(path_parts)
+            for name, value in defaults.items():
+                env.setdefault(name, value)
+            _env_cache[key] = env
+    return env
+
+
+def invalidate():
+    """清空缓存，下次使用时重新查找 gemini-cli 并重建环境变量"""
+    global _cli_path
+    with _lock:
+        _cli_path = None
+        _env_cache.clear()
+        _availability_cache.clear()
@@ -1,16 +1,83 @@
 """
 长连接版本的 Gemini CLI 客户端
-支持多个请求共享同一个 gemini 进程和会话
+支持多个请求共享同一个 gemini 进程和会话：每个请求带唯一 ID，按发送顺序排队，
+gemini 以带请求 ID 的结束标记收尾，读取线程据此把输出分发给对应的请求；
+进程崩溃时自动重启，并把还没收到响应的请求重发给新进程。
 """
+import codecs
 import subprocess
 import json
 import os
+import re
 import threading
-import queue
 import time
+import uuid
+from collections import OrderedDict
 from typing import Optional, Dict, Any, Tuple, List
 from datetime import datetime
 
+from gemini_env import find_gemini_cli, get_enhanced_env
+from stderr_classifier import classify_stderr
+
+
+# 每次从管道读取的最大字节数
+READ_CHUNK_SIZE = 64 * 1024
+
+# 进程崩溃时，正在等待的请求最多在重启后的进程上重发几次
+GEMINI_SESSION_RESTART_RETRIES = int(os.environ.get("GEMINI_SESSION_RESTART_RETRIES", "1"))
+
+# 响应结束标记：要求模型在回答结束后单独输出带请求 ID 的这一行，读取线程据此切分并分发响应
+RESPONSE_SENTINEL_PATTERN = re.compile(r"<<<GEMINI_RESPONSE_END id=([0-9a-f]+)>>>")
+
+
+def frame_message(request_id: str, message: str) -> str:
+    """
+    把消息封装为带结束标记要求的请求
+
+    Args:
+        request_id: 请求 ID
+        message: 用户消息
+
+    Returns:
+        写入 gemini stdin 的文本
+    """
+    sentinel = f"<<<GEMINI_RESPONSE_END id={request_id}>>>"
+    return f"{message}\n（回答完成后，请单独输出一行 {sentinel}，之后不要再输出任何内容）\n"
+
+
+class _PendingResponse:
+    """一个等待中的请求：读取线程收到它的结束标记后通过 Event 唤醒调用方"""
+
+    def __init__(self, message: str):
+        self.request_id = uuid.uuid4().hex
+        self.message = message
+        self.event = threading.Event()
+        self.lines: List[str] = []
+        self.stderr_lines: List[str] = []
+        self.error: Optional[str] = None
+        # 因进程崩溃而重发的次数
+        self.attempts = 0
+
+    def complete(self, lines: Optional[List[str]] = None, stderr_lines: Optional[List[str]] = None,
+                 error: Optional[str] = None):
+        self.lines = lines or []
+        self.stderr_lines = stderr_lines or []
+        self.error = error
+        self.event.set()
+
+    def result(self) -> Dict[str, Any]:
+        """构建响应字典"""
+        error_msg, info_logs = classify_stderr(self.stderr_lines)
+        if self.error:
+            error_msg = f"{self.error}\n{error_msg}" if error_msg else self.error
+        return {
+            "success": self.error is None,
+            "response": "".join(self.lines).strip(),
+            "error": error_msg,
+            "logs": info_logs,
+            "return_code": 0 if self.error is None else -1
+        }
+
 
 class GeminiSessionClient:
     """支持长连接的 Gemini CLI 客户端"""
@@ -31,10 +98,19 @@ class GeminiSessionClient:
         self.process_lock = threading.Lock()
         self.is_running = False
         
-        # 请求队列和响应映射
-        self.request_queue = queue.Queue()
-        self.response_map: Dict[str, Dict[str, Any]] = {}  # request_id -> response
+        # 已发送、等待响应的请求（按发送顺序）；写入 stdin 与登记请求在 write_lock 内完成，保证两者顺序一致
+        self.write_lock = threading.Lock()
         self.response_lock = threading.Lock()
+        self._inflight: "OrderedDict[str, _PendingResponse]" = OrderedDict()
+        # 队首请求目前收到的输出
+        self._lines: List[str] = []
+        self._stderr_lines: List[str] = []
+        
+        # 统计指标
+        self.completed = 0
+        self.lost = 0
+        self.restarts = 0
+        self.resent = 0
         
         # 输出读取线程
         self.stdout_thread: Optional[threading.Thread] = None
@@ -46,32 +122,12 @@ class GeminiSessionClient:
         self.approval_mode: Optional[str] = None
         
     def _find_gemini_cli(self) -> str:
-        """查找 gemini 可执行文件"""
-        possible_paths = [
-            "/opt/homebrew/bin/gemini",
-            "/usr/local/bin/gemini",
-            "gemini",
-        ]
-        for path in possible_paths:
-            if os.path.exists(path) and os.access(path, os.X_OK):
-                return path
-        return "gemini"
+        """查找 gemini 可执行文件（与其他客户端共享进程内缓存）"""
+        return find_gemini_cli()
     
     def _get_enhanced_env(self) -> Dict[str, str]:
-        """获取增强的环境变量"""
-        env = os.environ.copy()
-        path_parts = env.get("PATH", "").split(os.pathsep)
-        important_paths = [
-            "/opt/homebrew/bin",
-            "/usr/local/bin",
-            "/Users/ChuanHuang/.orbstack/bin",
-            os.path.expanduser("~/.orbstack/bin"),
-        ]
-        for path in important_paths:
-            if path and os.path.exists(path) and path not in path_parts:
-                path_parts.insert(0, path)
-        env["PATH"] = os.pathsep.join(path_parts)
-        return env
+        """获取增强的环境变量（进程内缓存）"""
+        return get_enhanced_env()
     
     def start_session(
         self,
@@ -126,21 +182,21 @@ class GeminiSessionClient:
                     stdin=subprocess.PIPE,
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE,
-                    text=True,
-                    bufsize=1,  # 行缓冲
                     env=env,
                     cwd=os.getcwd()
                 )
                 
                 self.is_running = True
                 
-                # 启动输出读取线程
+                # 启动输出读取线程（绑定到这个进程，进程被替换后旧线程不会影响新进程）
                 self.stdout_thread = threading.Thread(
                     target=self._read_stdout,
+                    args=(self.process,),
                     daemon=True
                 )
                 self.stderr_thread = threading.Thread(
                     target=self._read_stderr,
+                    args=(self.process,),
                     daemon=True
                 )
                 
@@ -157,65 +213,143 @@ class GeminiSessionClient:
                 self.is_running = False
                 return False
     
-    def _read_stdout(self):
-        """读取 stdout 的线程函数"""
-        if not self.process:
+    def _read_lines(self, stream):
+        """
+        按块读取管道并按行产出（增量解码，避免多字节字符被切断）
+
+        Yields:
+            完整的一行（包含换行符）；最后一段没有换行符的内容在 EOF 时产出
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        partial = ""
+        while True:
+            data = stream.read1(READ_CHUNK_SIZE)
+            text = decoder.decode(data, final=not data)
+            if text:
+                lines = (partial + text).split("\n")
+                partial = lines.pop()
+                for line in lines:
+                    yield line + "\n"
+            if not data:
+                break
+        if partial:
+            yield partial
+    
+    def _read_stdout(self, process: subprocess.Popen):
+        """读取 stdout 的线程函数：遇到结束标记行时把收集到的内容交给对应的请求"""
+        if not process.stdout:
             return
         
-        buffer = ""
-        current_request_id = None
+        try:
+            for line in self._read_lines(process.stdout):
+                match = RESPONSE_SENTINEL_PATTERN.fullmatch(line.strip())
+                with self.response_lock:
+                    if match is None:
+                        self._lines.append(line)
+                    else:
+                        self._dispatch(match.group(1))
+        except Exception as e:
+            print(f"读取 stdout 错误: {e}")
         
-        while self.is_running:
-            try:
-                if not self.process.stdout:
-                    break
-                    
-                char = self.process.stdout.read(1)
-                if not char:
-                    break
-                
-                buffer += char
-                
-                # 检测响应结束（这里需要根据 gemini 的实际输出格式调整）
-                # 简单策略：检测换行后的空行或特定标记
-                if buffer.endswith("\n\n") or len(buffer) > 10000:
-                    # 假设这是一个完整的响应
-                    if current_request_id:
-                        with self.response_lock:
-                            if current_request_id in self.response_map:
-                                self.response_map[current_request_id]["response"] = buffer.strip()
-                                self.response_map[current_request_id]["ready"] = True
-                        current_request_id = None
-                    buffer = ""
-                    
-            except Exception as e:
-                print(f"读取 stdout 错误: {e}")
-                break
+        self._handle_exit(process)
+    
+    def _read_stderr(self, process: subprocess.Popen):
+        """读取 stderr 的线程函数：日志归入队首请求"""
+        if not process.stderr:
+            return
+        
+        try:
+            for line in self._read_lines(process.stderr):
+                with self.response_lock:
+                    self._stderr_lines.append(line)
+        except Exception as e:
+            print(f"读取 stderr 错误: {e}")
+    
+    def _dispatch(self, request_id: str):
+        """
+        把收到的输出交给 request_id 对应的请求（调用方持有 response_lock）
+        
+        gemini 按发送顺序处理请求，排在它前面却没有收到结束标记的请求不会再有响应
+        """
+        lines, self._lines = self._lines, []
+        stderr_lines, self._stderr_lines = self._stderr_lines, []
+        if request_id not in self._inflight:
+            # 调用方已超时放弃
+            return
+        
+        while self._inflight:
+            key, pending = self._inflight.popitem(last=False)
+            if key == request_id:
+                pending.complete(lines, stderr_lines)
+                self.completed += 1
+                return
+            pending.complete(error="没有收到该请求的结束标记，响应已丢失")
+            self.lost += 1
     
-    def _read_stderr(self):
-        """读取 stderr 的线程函数"""
-        if not self.process:
+    def _handle_exit(self, process: subprocess.Popen):
+        """进程退出（崩溃）时重启，并把还没收到响应的请求重发给新进程"""
+        with self.write_lock:
+            with self.process_lock:
+                if self.process is not process:
+                    # 已经被 stop_session 或重启替换
+                    return
+                self.process = None
+                restart = self.is_running
+            with self.response_lock:
+                inflight = list(self._inflight.values())
+                self._inflight.clear()
+                self._lines = []
+                self._stderr_lines = []
+        
+        # stdout 已关闭，进程即使还没退出也无法继续使用
+        try:
+            returncode = process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            returncode = process.wait()
+        
+        retry = []
+        for pending in inflight:
+            if restart and pending.attempts < GEMINI_SESSION_RESTART_RETRIES:
+                retry.append(pending)
+            else:
+                pending.complete(error="gemini 进程已退出")
+        if not retry:
+            # 没有等待中的请求时不立即重启，下一次 chat 时再启动
+            return
+        
+        print(f"gemini 会话进程已退出（返回码 {returncode}），重启并重发 {len(retry)} 个请求")
+        if not self.start_session(self.model, self.mcp_servers, self.approval_mode):
+            for pending in retry:
+                pending.complete(error="gemini 进程已退出，无法重启")
             return
         
-        while self.is_running:
+        self.restarts += 1
+        for pending in retry:
+            pending.attempts += 1
+            self.resent += 1
             try:
-                if not self.process.stderr:
-                    break
-                    
-                line = self.process.stderr.readline()
-                if not line:
-                    break
-                
-                # 处理日志（可以记录或忽略）
-                # print(f"stderr: {line.strip()}")
-                
+                self._send(pending)
             except Exception as e:
-                print(f"读取 stderr 错误: {e}")
-                break
+                pending.complete(error=str(e))
+    
+    def _send(self, pending: _PendingResponse):
+        """登记请求并写入 stdin（写入失败说明进程已退出，由 _handle_exit 重发或报错）"""
+        with self.write_lock:
+            process = self.process
+            if process is None or process.stdin is None:
+                raise RuntimeError("进程 stdin 不可用")
+            with self.response_lock:
+                self._inflight[pending.request_id] = pending
+            try:
+                process.stdin.write(frame_message(pending.request_id, pending.message).encode("utf-8"))
+                process.stdin.flush()
+            except (BrokenPipeError, OSError):
+                pass
     
     def chat(self, message: str, timeout: int = 300) -> Dict[str, Any]:
         """
-        发送消息到 gemini 会话
+        发送消息到 gemini 会话（可以多个线程同时调用，请求按发送顺序由同一个进程处理）
         
         Args:
             message: 要发送的消息
@@ -226,7 +360,7 @@ class GeminiSessionClient:
         """
         # 确保会话已启动
         if not self.is_running or not self.process:
-            if not self.start_session():
+            if not self.start_session(self.model, self.mcp_servers, self.approval_mode or "yolo"):
                 return {
                     "success": False,
                     "response": "",
@@ -234,86 +368,48 @@ class GeminiSessionClient:
                     "return_code": -1
                 }
         
-        # 检查进程是否还在运行
-        if self.process.poll() is not None:
-            # 进程已退出，重新启动
-            self.is_running = False
-            if not self.start_session():
-                return {
-                    "success": False,
-                    "response": "",
-                    "error": "gemini 进程已退出，无法重启",
-                    "return_code": -1
-                }
-        
-        # 生成请求 ID
-        request_id = f"req_{int(time.time() * 1000)}"
-        
-        # 初始化响应
-        with self.response_lock:
-            self.response_map[request_id] = {
-                "response": "",
-                "error": None,
-                "logs": "",
-                "ready": False
-            }
-        
+        pending = _PendingResponse(message)
         try:
-            # 发送消息到进程
-            if self.process.stdin:
-                # 添加请求 ID 标记（如果 gemini 支持）
-                full_message = f"{message}\n"
-                self.process.stdin.write(full_message)
-                self.process.stdin.flush()
-            else:
-                return {
-                    "success": False,
-                    "response": "",
-                    "error": "进程 stdin 不可用",
-                    "return_code": -1
-                }
-            
-            # 等待响应（轮询方式）
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                with self.response_lock:
-                    if request_id in self.response_map and self.response_map[request_id]["ready"]:
-                        response_data = self.response_map[request_id]
-                        del self.response_map[request_id]
-                        
-                        return {
-                            "success": True,
-                            "response": response_data["response"],
-                            "error": response_data["error"],
-                            "logs": response_data["logs"],
-                            "return_code": 0
-                        }
-                
-                time.sleep(0.1)  # 100ms 轮询间隔
-            
-            # 超时
-            with self.response_lock:
-                if request_id in self.response_map:
-                    del self.response_map[request_id]
-            
+            self._send(pending)
+        except Exception as e:
             return {
                 "success": False,
                 "response": "",
-                "error": f"请求超时（{timeout}秒）",
+                "error": str(e),
                 "return_code": -1
             }
-            
-        except Exception as e:
+        
+        # 等待读取线程收到结束标记（不轮询）
+        if not pending.event.wait(timeout):
             with self.response_lock:
-                if request_id in self.response_map:
-                    del self.response_map[request_id]
-            
+                self._inflight.pop(pending.request_id, None)
             return {
                 "success": False,
                 "response": "",
-                "error": str(e),
+                "error": f"请求超时（{timeout}秒）",
                 "return_code": -1
             }
+        
+        return pending.result()
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取会话进程的统计信息
+        
+        Returns:
+            包含等待中的请求数、完成数、丢失数、重启次数等信息的字典
+        """
+        with self.response_lock:
+            inflight = len(self._inflight)
+        return {
+            "is_running": self.is_running,
+            "pid": self.process.pid if self.process else None,
+            "inflight": inflight,
+            "completed": self.completed,
+            "lost": self.lost,
+            "restarts": self.restarts,
+            "resent": self.resent
+        }
     
     def stop_session(self):
         """停止会话"""
@@ -331,6 +427,13 @@ class GeminiSessionClient:
                         pass
                 
                 self.process = None
+        
+        # 会话已停止，等待中的请求不会再收到响应
+        with self.response_lock:
+            inflight = list(self._inflight.values())
+            self._inflight.clear()
+        for pending in inflight:
+            pending.complete(error="会话已停止")
     
     def __del__(self):
         """析构函数，确保进程被清理"""
@@ -4,29 +4,85 @@
 注意：gemini 不支持通过 stdin 持续交互，所以每次请求仍然启动新进程
 但使用 --resume 可以保持对话上下文
 """
+import asyncio
+import hashlib
+import re
+import shutil
 import subprocess
 import os
+import tempfile
 import threading
-from typing import Optional, Dict, Any, List, Tuple
+import time
+from collections import OrderedDict, deque
+from typing import Optional, Dict, Any, List, Tuple, Union
 from pathlib import Path
 
+from admission_control import AdmissionRejected, admission_controller, rejected_result
+from gemini_client import run_cli_async, run_cli_sync, stderr_preview
+from gemini_env import find_gemini_cli, get_enhanced_env
+from output_capture import CapturedOutput, OutputLimitExceeded
+from session_index import session_index
+from stderr_classifier import classify_stderr
+
+
+# 最多同时保留多少个会话，超过后淘汰最久未使用的会话
+GEMINI_SESSION_MAX = int(os.environ.get("GEMINI_SESSION_MAX", "32"))
+# 会话空闲多久后被淘汰（秒）
+GEMINI_SESSION_IDLE_SECONDS = float(os.environ.get("GEMINI_SESSION_IDLE_SECONDS", "3600"))
+# 每个会话独立工作目录的根目录（gemini 按工作目录区分会话文件）
+GEMINI_SESSION_ROOT = os.environ.get(
+    "GEMINI_SESSION_ROOT", os.path.join(tempfile.gettempdir(), "gemini-sessions")
+)
+
+# 会话历史（累计的消息与回复）超过多少字节后压缩为摘要并开始新的会话文件，0 表示不压缩
+GEMINI_SESSION_MAX_HISTORY_BYTES = int(os.environ.get("GEMINI_SESSION_MAX_HISTORY_BYTES", "131072"))
+
+# 未指定 session_id / user_email 时使用的会话
+DEFAULT_SESSION_KEY = "default"
+
+# 压缩会话历史时发送给 gemini 的提示词
+COMPACTION_PROMPT = (
+    "请把我们到目前为止的对话压缩成一份摘要，供新的对话继续使用。"
+    "保留所有事实、结论、未完成的事项以及用户的偏好和约定，省略寒暄和重复内容。只输出摘要本身。"
+)
+# 新会话的第一条消息前附加的摘要
+SEED_TEMPLATE = "以下是之前对话的摘要，请在此基础上继续对话：\n{summary}\n\n{message}"
+
 
 class GeminiSessionSimple:
     """简化版的 Gemini 会话客户端（使用会话文件）"""
     
-    def __init__(self, cli_path: Optional[str] = None):
+    def __init__(self, cli_path: Optional[str] = None, session_dir: Optional[Path] = None):
         """
         初始化会话客户端
         
         Args:
             cli_path: gemini 可执行文件路径
+            session_dir: 会话的工作目录，默认为当前目录
         """
-        self.cli_path = cli_path or self._find_gemini_cli()
+        self._cli_path = cli_path
         self.lock = threading.Lock()
+        # 同一会话的请求依次执行（都依赖 --resume latest），不同会话之间互不影响
+        self.chat_lock = asyncio.Lock()
         
         # 会话管理（使用 gemini 的会话文件功能）
         self.session_id: Optional[str] = None  # 会话 ID，用于 --resume
-        self.session_dir = Path(os.getcwd())
+        self.session_dir = Path(session_dir) if session_dir else Path(os.getcwd())
+        self.last_used_at = time.monotonic()
+        
+        # 会话历史大小（每轮 --resume 都会重新加载整个历史），超过上限后压缩
+        self.max_history_bytes = GEMINI_SESSION_MAX_HISTORY_BYTES
+        self.history_bytes = 0
+        self.turn_count = 0
+        self.turns: "deque[Dict[str, Any]]" = deque(maxlen=50)
+        # 压缩后得到的摘要，附加在新会话的第一条消息前
+        self.seed_summary: Optional[str] = None
+        # 当前会话历史开头的摘要大小，只有摘要之后新增的历史才计入压缩阈值
+        self.summary_bytes = 0
+        self.compactions = 0
+        self.last_compaction_error: Optional[str] = None
+        # 正在后台运行的压缩任务（保留引用，避免被垃圾回收；同一时间只有一个）
+        self._compact_task: Optional[asyncio.Task] = None
         
         # 配置
         self.model: Optional[str] = None
@@ -37,35 +93,21 @@ class GeminiSessionSimple:
         self.session_initialized = False
     
     def _find_gemini_cli(self) -> str:
-        """查找 gemini 可执行文件"""
-        possible_paths = [
-            "/opt/homebrew/bin/gemini",
-            "/usr/local/bin/gemini",
-            "gemini",
-        ]
-        for path in possible_paths:
-            if os.path.exists(path) and os.access(path, os.X_OK):
-                return path
-        return "gemini"
+        """查找 gemini 可执行文件（与 GeminiCLIClient 共享进程内缓存）"""
+        return find_gemini_cli()
+    
+    @property
+    def cli_path(self) -> str:
+        """gemini 路径：构造时未指定则在第一次使用时查找"""
+        return self._cli_path or self._find_gemini_cli()
+    
+    @cli_path.setter
+    def cli_path(self, value: Optional[str]):
+        self._cli_path = value
     
     def _get_enhanced_env(self) -> Dict[str, str]:
-        """获取增强的环境变量"""
-        env = os.environ.copy()
-        path_parts = env.get("PATH", "").split(os.pathsep)
-        important_paths = [
-            "/opt/homebrew/bin",
-            "/usr/local/bin",
-            "/Users/ChuanHuang/.orbstack/bin",
-            os.path.expanduser("~/.orbstack/bin"),
-        ]
-        for path in important_paths:
-            if path and os.path.exists(path) and path not in path_parts:
-                path_parts.insert(0, path)
-        env["PATH"] = os.pathsep.join(path_parts)
-        # 确保包含 GOOGLE_CLOUD_PROJECT
-        if "GOOGLE_CLOUD_PROJECT" not in env:
-            env["GOOGLE_CLOUD_PROJECT"] = "codeassist-prod"
-        return env
+        """获取增强的环境变量（进程内缓存），确保包含 GOOGLE_CLOUD_PROJECT"""
+        return get_enhanced_env(GOOGLE_CLOUD_PROJECT="codeassist-prod")
     
     def _get_latest_session(self) -> Optional[str]:
         """
@@ -126,14 +168,28 @@ class GeminiSessionSimple:
                 self.approval_mode = approval_mode
                 self.session_initialized = True
                 
-                # 尝试获取现有会话
-                self.session_id = self._get_latest_session()
+                # 尝试获取现有会话（按工作目录缓存，目录未变化时不再执行 --list-sessions）
+                self.session_id = session_index.latest(self.session_dir, self._get_latest_session)
                 
                 return True
             except Exception as e:
                 print(f"初始化会话失败: {e}")
                 return False
     
+    async def astart(
+        self,
+        model: Optional[str] = None,
+        mcp_servers: Optional[List[str]] = None,
+        approval_mode: str = "yolo"
+    ) -> bool:
+        """
+        start 的异步版本：索引未命中时会执行 `gemini --list-sessions`（最多 5 秒），放到线程中运行，不阻塞事件循环
+        
+        Returns:
+            是否成功初始化
+        """
+        return await asyncio.to_thread(self.start, model, mcp_servers, approval_mode)
+    
     def chat(self, message: str, timeout: int = 300) -> Dict[str, Any]:
         """
         发送消息（使用会话文件保持上下文）
@@ -156,135 +212,271 @@ class GeminiSessionSimple:
                 }
         
         try:
-            # 构建命令
-            cmd = [self.cli_path]
-            
-            # 添加模型参数
-            if self.model:
-                cmd.extend(["--model", self.model])
-            
-            # 添加 MCP 服务器参数
-            if self.mcp_servers:
-                for server_name in self.mcp_servers:
-                    cmd.extend(["--allowed-mcp-server-names", server_name])
-            
-            # 添加审批模式
-            if self.approval_mode:
-                cmd.extend(["--approval-mode", self.approval_mode])
-            
-            # 关键：使用 --resume 恢复会话（如果存在）
-            if self.session_id:
-                cmd.extend(["--resume", self.session_id])
+            cmd = self._build_cmd()
+            seeded = self.seed_summary is not None
+            prompt = SEED_TEMPLATE.format(summary=self.seed_summary, message=message) if seeded else message
             
             # 执行命令
             env = self._get_enhanced_env()
             
-            process = subprocess.run(
-                cmd,
-                input=message,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                timeout=timeout,
-                env=env,
-                cwd=self.session_dir
-            )
-            
-            stdout = process.stdout
-            stderr = process.stderr
-            
-            # 解析 stderr（区分错误和信息性消息）
-            error_msg, info_logs = self._parse_stderr(stderr)
-            
-            # 更新会话 ID（使用 latest）
-            if process.returncode == 0:
-                self.session_id = "latest"
-            
-            # 如果返回码不为0，即使没有明确的错误消息，也认为有错误
-            if process.returncode != 0 and not error_msg:
-                error_msg = stderr.strip() if stderr else "Command failed with non-zero exit code"
-            
-            return {
-                "success": process.returncode == 0,
-                "response": stdout.strip() if stdout else "",
-                "error": error_msg,
-                "logs": info_logs,
-                "return_code": process.returncode
-            }
+            started_at = time.monotonic()
+            returncode, stdout, stderr = run_cli_sync(cmd, prompt, env, self.session_dir, timeout=timeout)
+            with stderr:
+                result = self._build_result(returncode, stdout, stderr)
+            if result["success"]:
+                if seeded:
+                    self.seed_summary = None
+                # 摘要在压缩时已经计入 history_bytes，这里只记录消息本身
+                self._record_turn(message, result["response"], time.monotonic() - started_at)
+            return result
             
         except subprocess.TimeoutExpired:
-            return {
-                "success": False,
-                "response": "",
-                "error": f"请求超时（{timeout}秒）",
-                "return_code": -1
-            }
+            return self._timeout_result(timeout)
+        except OutputLimitExceeded as e:
+            return self._exception_result(e)
         except FileNotFoundError:
-            return {
-                "success": False,
-                "response": "",
-                "error": f"gemini not found at: {self.cli_path}",
-                "return_code": -1
-            }
+            return self._not_found_result()
         except Exception as e:
-            return {
-                "success": False,
-                "response": "",
-                "error": str(e),
-                "return_code": -1
-            }
+            return self._exception_result(e)
     
-    def _parse_stderr(self, stderr: str) -> Tuple[Optional[str], Optional[str]]:
+    async def achat(self, message: str, timeout: int = 300) -> Dict[str, Any]:
         """
-        解析 stderr，区分错误和信息性消息
+        chat 的异步版本：使用 asyncio 子进程，不阻塞事件循环
+        
+        Args:
+            message: 要发送的消息
+            timeout: 超时时间（秒）
         
         Returns:
-            (error_message, info_logs)
+            响应字典
+        """
+        if not self.session_initialized:
+            if not await self.astart():
+                return {
+                    "success": False,
+                    "response": "",
+                    "error": "无法初始化会话",
+                    "return_code": -1
+                }
+        
+        async with self.chat_lock:
+            self.last_used_at = time.monotonic()
+            seeded = self.seed_summary is not None
+            prompt = SEED_TEMPLATE.format(summary=self.seed_summary, message=message) if seeded else message
+            
+            started_at = time.monotonic()
+            result = await self._arun(prompt, timeout)
+            if result["success"]:
+                if seeded:
+                    self.seed_summary = None
+                # 摘要在压缩时已经计入 history_bytes，这里只记录消息本身
+                self._record_turn(message, result["response"], time.monotonic() - started_at)
+        
+        if result["success"] and self._needs_compaction() and (self._compact_task is None or self._compact_task.done()):
+            # 在后台压缩，不增加本次请求的延迟；压缩要 --resume 同一个会话文件，所以会持有会话锁，
+            # 压缩期间到达的下一轮请求需要等它完成
+            self._compact_task = asyncio.ensure_future(self.acompact(timeout))
+            self._compact_task.add_done_callback(self._on_compact_done)
+        return result
+    
+    def _on_compact_done(self, task: "asyncio.Task[bool]"):
+        """取回后台压缩任务的异常并记录，避免 "Task exception was never retrieved" """
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.last_compaction_error = str(error) or type(error).__name__
+            print(f"压缩会话历史时出错: {error!r}")
+    
+    async def _arun(self, message: str, timeout: int) -> Dict[str, Any]:
+        """在会话目录中执行一次 gemini 调用（调用方持有 chat_lock）"""
+        try:
+            # 会话目录可能在等待期间被注册表清理过
+            self.session_dir.mkdir(parents=True, exist_ok=True)
+            async with admission_controller.slot(self.model):
+                returncode, stdout, stderr = await run_cli_async(
+                    self._build_cmd(), message, env=self._get_enhanced_env(),
+                    cwd=self.session_dir, timeout=timeout
+                )
+            with stderr:
+                return self._build_result(returncode, stdout, stderr)
+        except AdmissionRejected as e:
+            return rejected_result(e)
+        except asyncio.TimeoutError:
+            return self._timeout_result(timeout)
+        except FileNotFoundError:
+            return self._not_found_result()
+        except Exception as e:
+            return self._exception_result(e)
+    
+    def _record_turn(self, message: str, response: str, latency: float):
+        """记录一轮对话后的历史大小和耗时（用于观察延迟随历史增长的曲线）"""
+        self.turn_count += 1
+        self.history_bytes += len(message.encode("utf-8")) + len(response.encode("utf-8"))
+        self.turns.append({
+            "turn": self.turn_count,
+            "history_bytes": self.history_bytes,
+            "latency_seconds": round(latency, 2),
+            "at": time.strftime("%Y-%m-%d %H:%M:%S")
+        })
+    
+    def _needs_compaction(self) -> bool:
+        # 摘要本身超过上限时，只剩摘要的历史再压缩也不会变小，不计入阈值
+        return (
+            0 < self.max_history_bytes < self.history_bytes - self.summary_bytes
+            and self.session_id is not None
+        )
+    
+    async def acompact(self, timeout: int = 300) -> bool:
         """
-        if not stderr or not stderr.strip():
-            return None, None
+        把会话历史压缩为摘要，并开始新的会话文件（下一条消息附带摘要发送，不再 --resume 旧历史）
         
-        lines = stderr.strip().split('\n')
-        error_lines = []
-        info_lines = []
+        摘要需要 --resume 当前的会话文件生成，整个过程持有会话锁：
+        压缩期间该会话的下一轮请求会多等一次 gemini 调用的时间。
         
-        info_keywords = [
-            "Loaded cached credentials",
-            "Server",
-            "supports",
-            "Listening for changes",
-            "YOLO mode is enabled",
-        ]
+        Args:
+            timeout: 超时时间（秒）
         
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
+        Returns:
+            是否压缩成功
+        """
+        async with self.chat_lock:
+            if not self._needs_compaction():
+                return False
             
-            # 检查是否是信息性消息
-            is_info = any(keyword.lower() in line.lower() for keyword in info_keywords)
+            result = await self._arun(COMPACTION_PROMPT, timeout)
+            summary = result.get("response", "").strip()
+            if not result["success"] or not summary:
+                self.last_compaction_error = result.get("error") or "摘要为空"
+                print(f"压缩会话历史失败: {self.last_compaction_error}")
+                return False
             
-            if is_info:
-                info_lines.append(line)
-            else:
-                # 检查是否是错误
-                error_indicators = ['error', 'failed', 'exception', 'fatal', 'cannot', "can't"]
-                if any(indicator in line.lower() for indicator in error_indicators):
-                    error_lines.append(line)
-                else:
-                    # 不确定，默认当作信息
-                    info_lines.append(line)
+            previous_bytes = self.history_bytes
+            self.seed_summary = summary
+            # 不再 --resume，下一次调用会创建新的会话文件
+            self.session_id = None
+            self.history_bytes = len(summary.encode("utf-8"))
+            self.summary_bytes = self.history_bytes
+            self.compactions += 1
+            self.last_compaction_error = None
+            print(f"会话历史已压缩: {previous_bytes} -> {self.history_bytes} 字节")
+            return True
+    
+    def _build_cmd(self) -> List[str]:
+        """根据当前会话配置构建命令"""
+        cmd = [self.cli_path]
+        
+        # 添加模型参数
+        if self.model:
+            cmd.extend(["--model", self.model])
+        
+        # 添加 MCP 服务器参数
+        if self.mcp_servers:
+            for server_name in self.mcp_servers:
+                cmd.extend(["--allowed-mcp-server-names", server_name])
         
-        error_msg = '\n'.join(error_lines) if error_lines else None
-        info_logs = '\n'.join(info_lines) if info_lines else None
+        # 添加审批模式
+        if self.approval_mode:
+            cmd.extend(["--approval-mode", self.approval_mode])
+        
+        # 关键：使用 --resume 恢复会话（如果存在）
+        if self.session_id:
+            cmd.extend(["--resume", self.session_id])
+        
+        return cmd
+    
+    def _build_result(self, returncode: int, stdout: Optional[str],
+                      stderr: Union[str, CapturedOutput, None]) -> Dict[str, Any]:
+        """根据进程退出码和输出构建响应字典，并更新会话 ID"""
+        # 解析 stderr（区分错误和信息性消息）
+        error_msg, info_logs = self._parse_stderr(stderr)
+        
+        # 更新会话 ID（使用 latest），并同步到会话索引
+        if returncode == 0:
+            self.session_id = "latest"
+            session_index.record(self.session_dir, self.session_id)
+        
+        # 如果返回码不为0，即使没有明确的错误消息，也认为有错误
+        if returncode != 0 and not error_msg:
+            error_msg = stderr_preview(stderr) or "Command failed with non-zero exit code"
+        
+        return {
+            "success": returncode == 0,
+            "response": stdout.strip() if stdout else "",
+            "error": error_msg,
+            "logs": info_logs,
+            "return_code": returncode
+        }
+    
+    def _timeout_result(self, timeout: int) -> Dict[str, Any]:
+        """超时时的响应字典"""
+        return {
+            "success": False,
+            "response": "",
+            "error": f"请求超时（{timeout}秒）",
+            "return_code": -1
+        }
+    
+    def _not_found_result(self) -> Dict[str, Any]:
+        """找不到 gemini 时的响应字典"""
+        return {
+            "success": False,
+            "response": "",
+            "error": f"gemini not found at: {self.cli_path}",
+            "return_code": -1
+        }
+    
+    def _exception_result(self, e: Exception) -> Dict[str, Any]:
+        """其他异常时的响应字典"""
+        return {
+            "success": False,
+            "response": "",
+            "error": str(e),
+            "return_code": -1
+        }
+    
+    def _parse_stderr(self, stderr: Union[str, CapturedOutput, None]) -> Tuple[Optional[str], Optional[str]]:
+        """
+        解析 stderr，区分错误和信息性消息（与 GeminiCLIClient 共用 stderr_classifier）
         
-        return error_msg, info_logs
+        Returns:
+            (error_message, info_logs)
+        """
+        return classify_stderr(stderr)
     
     def stop(self):
         """停止会话（清理会话 ID）"""
         with self.lock:
             self.session_id = None
             self.session_initialized = False
+            self.history_bytes = 0
+            self.summary_bytes = 0
+            self.seed_summary = None
+    
+    @property
+    def is_busy(self) -> bool:
+        """是否有请求正在使用该会话"""
+        return self.chat_lock.locked()
+    
+    def status(self) -> Dict[str, Any]:
+        """获取会话状态"""
+        return {
+            "is_running": self.is_running,
+            "session_initialized": self.session_initialized,
+            "session_id": self.session_id,
+            "session_dir": str(self.session_dir),
+            "model": self.model,
+            "mcp_servers": self.mcp_servers,
+            "approval_mode": self.approval_mode,
+            "busy": self.is_busy,
+            "idle_seconds": round(time.monotonic() - self.last_used_at, 1),
+            "history_bytes": self.history_bytes,
+            "max_history_bytes": self.max_history_bytes,
+            "summary_bytes": self.summary_bytes,
+            "compactions": self.compactions,
+            "last_compaction_error": self.last_compaction_error,
+            "turns": list(self.turns)
+        }
     
     @property
     def is_running(self) -> bool:
@@ -297,16 +489,139 @@ class GeminiSessionSimple:
         return None
 
 
-# 全局会话实例（单例模式）
-_session: Optional[GeminiSessionSimple] = None
-_session_lock = threading.Lock()
+def session_key(session_id: Optional[str] = None, user_email: Optional[str] = None) -> str:
+    """
+    计算会话的键：优先使用客户端传入的 session_id，其次是 user_email
 
+    Returns:
+        会话键
+    """
+    return session_id or user_email or DEFAULT_SESSION_KEY
 
-def get_session() -> GeminiSessionSimple:
-    """获取全局会话实例"""
-    global _session
-    
-    with _session_lock:
-        if _session is None:
-            _session = GeminiSessionSimple()
-        return _session
+
+class SessionRegistry:
+    """按 session_id / user_email 管理多个 GeminiSessionSimple（LRU + 空闲超时淘汰）"""
+
+    def __init__(self, max_sessions: int = GEMINI_SESSION_MAX,
+                 idle_seconds: float = GEMINI_SESSION_IDLE_SECONDS,
+                 root_dir: str = GEMINI_SESSION_ROOT):
+        """
+        初始化会话注册表
+
+        Args:
+            max_sessions: 最多同时保留的会话数
+            idle_seconds: 会话空闲多久后被淘汰（秒）
+            root_dir: 会话工作目录的根目录
+        """
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.root_dir = Path(root_dir)
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, GeminiSessionSimple]" = OrderedDict()
+
+        # 统计指标
+        self.created = 0
+        self.evicted = 0
+
+    def _session_dir(self, key: str) -> Path:
+        """会话键对应的工作目录（可读的前缀 + 哈希，避免特殊字符和冲突）"""
+        readable = re.sub(r"[^A-Za-z0-9_.-]", "_", key)[:40]
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+        return self.root_dir / f"{readable}-{digest}"
+
+    def get(self, key: str, create: bool = True) -> Optional[GeminiSessionSimple]:
+        """
+        获取会话（必要时创建），并刷新其最近使用时间
+
+        Args:
+            key: 会话键，见 session_key()
+            create: 不存在时是否创建
+
+        Returns:
+            会话实例；不存在且 create=False 时返回 None
+        """
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+                session.last_used_at = time.monotonic()
+                return session
+            if not create:
+                return None
+
+            session_dir = self._session_dir(key)
+            session_dir.mkdir(parents=True, exist_ok=True)
+            session = GeminiSessionSimple(session_dir=session_dir)
+            self._sessions[key] = session
+            self.created += 1
+            self._evict_overflow()
+            return session
+
+    def remove(self, key: str) -> bool:
+        """
+        停止并移除会话
+
+        Returns:
+            会话存在返回 True
+        """
+        with self._lock:
+            session = self._sessions.pop(key, None)
+        if session is None:
+            return False
+        self._discard(session)
+        return True
+
+    def _evict_idle(self):
+        """淘汰空闲超时且没有请求在使用的会话"""
+        now = time.monotonic()
+        for key, session in list(self._sessions.items()):
+            if not session.is_busy and now - session.last_used_at >= self.idle_seconds:
+                del self._sessions[key]
+                self.evicted += 1
+                self._discard(session)
+
+    def _evict_overflow(self):
+        """会话数超过上限时，从最久未使用的开始淘汰（跳过正在使用的会话）"""
+        for key, session in list(self._sessions.items()):
+            if len(self._sessions) <= self.max_sessions:
+                return
+            if session.is_busy:
+                continue
+            del self._sessions[key]
+            self.evicted += 1
+            self._discard(session)
+
+    def _discard(self, session: GeminiSessionSimple):
+        session.stop()
+        shutil.rmtree(session.session_dir, ignore_errors=True)
+        session_index.invalidate(session.session_dir)
+
+    def status(self) -> Dict[str, Any]:
+        """
+        获取注册表状态
+
+        Returns:
+            包含会话数量、上限、淘汰次数以及各会话状态的字典
+        """
+        with self._lock:
+            self._evict_idle()
+            sessions = {key: session.status() for key, session in self._sessions.items()}
+        return {
+            "count": len(sessions),
+            "max_sessions": self.max_sessions,
+            "idle_seconds": self.idle_seconds,
+            "created": self.created,
+            "evicted": self.evicted,
+            "index": session_index.stats(),
+            "sessions": sessions
+        }
+
+
+# 全局会话注册表
+session_registry = SessionRegistry()
+
+
+def get_session(key: str = DEFAULT_SESSION_KEY) -> GeminiSessionSimple:
+    """获取（必要时创建）指定键的会话实例"""
+    return session_registry.get(key)
@@ -0,0 +1,284 @@
+"""
+gemini-cli 预热进程池
+gemini 在非交互模式下每次调用都要冷启动 Node 进程（加载凭据、Hook、连接 MCP 服务器），
+进程池会按命令参数（模型、MCP 服务器、审批模式等）提前拉起进程，让它们停在读取 stdin 的位置，
+请求到来时直接租用一个已就绪的进程写入消息即可。
+注意：gemini 读完 stdin 后即处理并退出，所以每个预热进程只服务一次请求，用完后由池子在后台补齐。
+"""
+import asyncio
+import os
+import signal
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+
+
+# 每种命令参数组合保留的空闲预热进程数（0 表示关闭进程池，所有请求都冷启动）
+GEMINI_POOL_SIZE = int(os.environ.get("GEMINI_POOL_SIZE", "0"))
+# 预热进程最长空闲时间（秒），超过后回收重建，避免凭据或 MCP 连接过期
+GEMINI_POOL_MAX_IDLE_SECONDS = float(os.environ.get("GEMINI_POOL_MAX_IDLE_SECONDS", "600"))
+# 最多为多少种命令参数组合保留预热进程（按最近使用淘汰）
+GEMINI_POOL_MAX_KEYS = int(os.environ.get("GEMINI_POOL_MAX_KEYS", "8"))
+
+
+async def spawn_cli_process(cmd: List[str], env: Dict[str, str], cwd) -> asyncio.subprocess.Process:
+    """
+    启动一个 gemini 子进程（stdin/stdout/stderr 全部通过管道连接）
+
+    Args:
+        cmd: 完整命令列表
+        env: 环境变量
+        cwd: 工作目录
+
+    Returns:
+        asyncio 子进程对象
+    """
+    return await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+        env=env,
+        # 独立的进程组，取消时可以连同 gemini 拉起的 MCP 子进程一起结束
+        start_new_session=hasattr(os, "killpg")
+    )
+
+
+def kill_process_tree(process: asyncio.subprocess.Process):
+    """
+    结束 gemini 进程及其整个进程组（包括它拉起的 MCP 服务器等子进程）
+
+    Args:
+        process: spawn_cli_process 启动的子进程
+    """
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+            return
+        except (ProcessLookupError, PermissionError):
+            pass
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+
+
+async def terminate_process(process: asyncio.subprocess.Process):
+    """
+    结束进程组并等待其退出
+
+    asyncio 的 wait() 要等所有管道关闭才返回，而读取方已经停下时管道缓冲区可能是满的，
+    所以这里会丢弃管道中剩余的输出。调用前需要确保没有其他协程正在读取 stdout / stderr。
+
+    Args:
+        process: spawn_cli_process 启动的子进程
+    """
+    if process.returncode is None:
+        kill_process_tree(process)
+    for stream in (process.stdout, process.stderr):
+        if stream is not None:
+            while await stream.read(65536):
+                pass
+    await process.wait()
+
+
+class _Worker:
+    """一个已启动、等待 stdin 输入的 gemini 进程"""
+
+    def __init__(self, process: asyncio.subprocess.Process):
+        self.process = process
+        self.created_at = time.monotonic()
+
+    def is_healthy(self, max_idle_seconds: float) -> bool:
+        """进程仍在运行且没有空闲过久"""
+        return (
+            self.process.returncode is None
+            and time.monotonic() - self.created_at < max_idle_seconds
+        )
+
+    def discard(self):
+        """杀掉不再使用的进程"""
+        if self.process.returncode is None:
+            kill_process_tree(self.process)
+
+
+class GeminiWorkerPool:
+    """按命令参数分组的 gemini 预热进程池"""
+
+    def __init__(
+        self,
+        size: int = GEMINI_POOL_SIZE,
+        max_idle_seconds: float = GEMINI_POOL_MAX_IDLE_SECONDS,
+        max_keys: int = GEMINI_POOL_MAX_KEYS
+    ):
+        """
+        初始化进程池
+
+        Args:
+            size: 每种命令参数组合保留的空闲进程数，0 表示关闭
+            max_idle_seconds: 空闲进程的最长存活时间（秒）
+            max_keys: 最多保留多少种命令参数组合
+        """
+        self.size = size
+        self.max_idle_seconds = max_idle_seconds
+        self.max_keys = max_keys
+
+        # key(命令元组) -> 空闲进程列表，按最近使用排序
+        self._idle: "OrderedDict[Tuple[str, ...], List[_Worker]]" = OrderedDict()
+        # key -> (env, cwd)，补齐进程时使用
+        self._spawn_args: Dict[Tuple[str, ...], Tuple[Dict[str, str], Any]] = {}
+        # key -> 正在后台启动的进程数
+        self._pending: Dict[Tuple[str, ...], int] = {}
+        self._fill_tasks: set = set()
+
+        # 统计指标
+        self.hits = 0
+        self.cold_spawns = 0
+        self.warm_spawns = 0
+        self.recycled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    async def lease(self, cmd: List[str], env: Dict[str, str], cwd) -> asyncio.subprocess.Process:
+        """
+        租用一个可以直接写入消息的 gemini 进程
+
+        有健康的预热进程则直接返回，否则冷启动一个新进程；
+        无论命中与否都会在后台把该参数组合的空闲进程补齐到 size 个。
+
+        Args:
+            cmd: 完整命令列表（作为池的 key）
+            env: 环境变量
+            cwd: 工作目录
+
+        Returns:
+            asyncio 子进程对象，调用方负责与其通信并等待退出
+        """
+        if not self.enabled:
+            return await spawn_cli_process(cmd, env, cwd)
+
+        key = tuple(cmd)
+        self._spawn_args[key] = (env, cwd)
+        # 租用前巡检一遍，已退出或空闲过久的进程不会被交给调用方
+        self.check_health()
+        worker = self._pop_healthy(key)
+
+        if worker is not None:
+            self.hits += 1
+            process = worker.process
+        else:
+            self.cold_spawns += 1
+            process = await spawn_cli_process(cmd, env, cwd)
+
+        self._schedule_fill(key)
+        return process
+
+    def _pop_healthy(self, key: Tuple[str, ...]) -> Optional[_Worker]:
+        """取出一个健康的空闲进程，顺便回收不健康的"""
+        workers = self._idle.get(key)
+        if workers is None:
+            return None
+        self._idle.move_to_end(key)
+
+        while workers:
+            worker = workers.pop(0)
+            if worker.is_healthy(self.max_idle_seconds):
+                return worker
+            worker.discard()
+            self.recycled += 1
+        return None
+
+    def _schedule_fill(self, key: Tuple[str, ...]):
+        """在后台补齐指定参数组合的空闲进程"""
+        if key not in self._idle:
+            self._idle[key] = []
+            self._evict_keys()
+
+        missing = self.size - len(self._idle[key]) - self._pending.get(key, 0)
+        if missing <= 0:
+            return
+
+        self._pending[key] = self._pending.get(key, 0) + missing
+        task = asyncio.get_running_loop().create_task(self._fill(key, missing))
+        self._fill_tasks.add(task)
+        task.add_done_callback(self._fill_tasks.discard)
+
+    async def _fill(self, key: Tuple[str, ...], count: int):
+        """启动 count 个预热进程并放入空闲列表"""
+        try:
+            spawn_args = self._spawn_args.get(key)
+            if spawn_args is None:
+                # 任务开始前该 key 已被淘汰
+                return
+            env, cwd = spawn_args
+            for _ in range(count):
+                process = await spawn_cli_process(list(key), env, cwd)
+                worker = _Worker(process)
+                if key in self._idle:
+                    self._idle[key].append(worker)
+                    self.warm_spawns += 1
+                else:
+                    # 启动期间该 key 已被淘汰
+                    worker.discard()
+        except Exception as e:
+            print(f"预热 gemini 进程失败: {e}")
+        finally:
+            self._pending[key] -= count
+            if self._pending[key] <= 0:
+                del self._pending[key]
+
+    def _evict_keys(self):
+        """参数组合过多时淘汰最久未使用的组合"""
+        while len(self._idle) > self.max_keys:
+            key, workers = self._idle.popitem(last=False)
+            self._spawn_args.pop(key, None)
+            for worker in workers:
+                worker.discard()
+                self.recycled += 1
+
+    def check_health(self):
+        """巡检所有空闲进程，回收已退出或空闲过久的进程"""
+        for workers in self._idle.values():
+            healthy = []
+            for worker in workers:
+                if worker.is_healthy(self.max_idle_seconds):
+                    healthy.append(worker)
+                else:
+                    worker.discard()
+                    self.recycled += 1
+            workers[:] = healthy
+
+    def drain(self):
+        """清空所有空闲进程（例如配置变更或服务关闭时）"""
+        for workers in self._idle.values():
+            for worker in workers:
+                worker.discard()
+                self.recycled += 1
+            workers.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取进程池统计信息
+
+        Returns:
+            包含命中次数、冷启动次数等指标的字典
+        """
+        self.check_health()
+        leases = self.hits + self.cold_spawns
+        return {
+            "enabled": self.enabled,
+            "size": self.size,
+            "max_idle_seconds": self.max_idle_seconds,
+            "hits": self.hits,
+            "cold_spawns": self.cold_spawns,
+            "hit_rate": round(self.hits / leases, 4) if leases else 0.0,
+            "warm_spawns": self.warm_spawns,
+            "recycled": self.recycled,
+            "idle_workers": sum(len(workers) for workers in self._idle.values()),
+            "pending_workers": sum(self._pending.values()),
+            "keys": len(self._idle)
+        }
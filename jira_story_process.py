@@ -1,26 +1,70 @@
 import datetime
 import asyncio
-
-from models import ChatResponse, ChatRequest
-from fastapi import HTTPException, APIRouter
-from analyze_data_storage import parse_to_json, get_story_description
+import os
+from typing import Optional
+
+from models import ChatResponse, ChatRequest, StoryDescriptionsRequest
+from fastapi import HTTPException, APIRouter, BackgroundTasks, Header, Request, Response
+from fastapi.responses import JSONResponse
+from analyze_data_storage import (parse_to_json, get_story_description, get_story_descriptions,
+                                  get_story_versions, save_story_tags, story_etag)
 from gemini_client import gemini_client
-from redis_utils import query_redis, set_redis
+from request_cancellation import run_until_disconnected
+from response_cache import should_bypass_cache
+from streaming import gemini_sse_events, sse_response
+from tag_rules import tag_rules_cache
 import json
 
 router = APIRouter()
 
+# 各接口的 gemini 响应缓存时间（秒），0 表示不缓存
+PERSONAL_TASK_CACHE_TTL = int(os.environ.get("GEMINI_CACHE_TTL_PERSONAL_TASK", "300"))
+STORY_LIST_CACHE_TTL = int(os.environ.get("GEMINI_CACHE_TTL_STORY_LIST", "300"))
+STORY_CHECK_CACHE_TTL = int(os.environ.get("GEMINI_CACHE_TTL_STORY_CHECK", "600"))
+
+# story 标签在 Redis 中的保存时间（秒）
+STORY_TAGS_EXPIRY = 30 * 24 * 60 * 60  # 1 month in seconds
+# 是否在返回响应之后再批量写入 story 标签（不占用请求耗时）
+STORY_TAGS_BACKGROUND_WRITE = os.environ.get("STORY_TAGS_BACKGROUND_WRITE", "1") == "1"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否命中当前 ETag（弱比较，支持多个值和 *）"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in candidates)
+
 
 @router.get("/story/description")
-async def story_description(story_id):
+async def story_description(story_id, if_none_match: Optional[str] = Header(None)):
     """
     给浏览器油猴用的
+    带 ETag（story 版本号）；If-None-Match 命中时返回 304，只读取版本号，不读取进度和标签
+    """
+    etag = story_etag(await asyncio.to_thread(get_story_versions, [story_id]))
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    content = await asyncio.to_thread(get_story_description, story_id)
+    return JSONResponse(content=content, headers={"ETag": etag})
+
+
+@router.post("/story/descriptions")
+async def story_descriptions(request: StoryDescriptionsRequest, if_none_match: Optional[str] = Header(None)):
+    """
+    给浏览器油猴用的批量版本：一次请求获取整个看板上所有 story 的进度和标签
+    返回以 story_id 为 key 的字典；ETag 由所有 story 的版本号生成，If-None-Match 命中时返回 304
     """
-    return get_story_description(story_id)
+    etag = story_etag(await asyncio.to_thread(get_story_versions, request.story_ids))
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    content = await asyncio.to_thread(get_story_descriptions, request.story_ids)
+    return JSONResponse(content=content, headers={"ETag": etag})
 
 
 @router.post("/api/gemini/board/personal/task/processing", response_model=ChatResponse)
-async def personal_task_processing(request: ChatRequest):
+async def personal_task_processing(request: ChatRequest, http_request: Request,
+                                  cache_control: Optional[str] = Header(None)):
     get_personal_tasks_prompt = """
     请按照以下步骤执行：
     step1: 获取看板[3485]状态为 'active' 的 sprint_id。
@@ -54,18 +98,21 @@ async def personal_task_processing(request: ChatRequest):
             kwargs = {
                 "approval_mode": "yolo"
             }
-            result = gemini_client.chat(
+            result = await run_until_disconnected(http_request, gemini_client.achat(
                 prompt,
                 model=request.model,
+                cache_ttl=PERSONAL_TASK_CACHE_TTL,
+                force=should_bypass_cache(request.force, cache_control),
                 mcp_servers=['jira'],
                 **kwargs
-            )
+            ))
             print(f">>> personal_task_processing gemini_res, {result}")
 
         if not result.get("success"):
             raise HTTPException(
-                status_code=500,
-                detail=result.get("error", "Unknown error occurred during gemini chat")
+                status_code=result.get("status_code", 500),
+                detail=result.get("error", "Unknown error occurred during gemini chat"),
+                headers=result.get("headers")
             )
 
         response_content = result.get('response', '')
@@ -95,23 +142,8 @@ async def personal_task_processing(request: ChatRequest):
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
-@router.post("/api/gemini/board/story/list", response_model=ChatResponse)
-async def story_list(request: ChatRequest):
-    """
-    查看看板下当前sprint正在进行的story，并打上风险标记
-    """
-    # 规则获取
-    delay_rules = []
-    risk_rules = []
-
-    tags_data = query_redis('get', 'scrum_master_tag_rules')
-    for tag in tags_data:
-        if tag.get('tagName', '') == 'delay':
-            delay_rules += tag.get('rules', [])
-        elif tag.get('tagName', '') == 'risk':
-            risk_rules += tag.get('rules', [])
-
-    get_jira_board_story = """
+# story_list 的 prompt 模板，{{DELAY_RULES}} / {{RISK_RULES}} 由 tag_rules 填入
+STORY_LIST_PROMPT_TEMPLATE = """
     请按照以下步骤执行：
     step1: 获取看板[3485]状态为 'active' 的 sprint_id
     step2: 使用jira_search (jira MCP Server)获取当前sprint的story {"limit":50,"jql":"project = ORI AND sprint = {sprint_id} AND issuetype = Story"}
@@ -141,11 +173,24 @@ async def story_list(request: ChatRequest):
     ]
     """
 
-    indented_delay_rules = [f"           {rule}" for rule in delay_rules]
-    indented_risk_rules = [f"           {rule}" for rule in risk_rules]
 
-    get_jira_board_story = get_jira_board_story.replace("{{DELAY_RULES}}", '\n'.join(indented_delay_rules))
-    get_jira_board_story = get_jira_board_story.replace("{{RISK_RULES}}", '\n'.join(indented_risk_rules))
+@router.post("/api/gemini/board/story/rules/invalidate")
+async def invalidate_story_tag_rules():
+    """
+    MeetingGenie 保存规则后调用：下一次 story_list 重新从 Redis 读取 scrum_master_tag_rules
+    """
+    tag_rules_cache.invalidate()
+    return {"success": True, "tag_rules": tag_rules_cache.stats()}
+
+
+@router.post("/api/gemini/board/story/list", response_model=ChatResponse)
+async def story_list(request: ChatRequest, http_request: Request, background_tasks: BackgroundTasks,
+                    cache_control: Optional[str] = Header(None)):
+    """
+    查看看板下当前sprint正在进行的story，并打上风险标记
+    """
+    # 规则来自 MeetingGenie 保存在 Redis 中的 scrum_master_tag_rules（带 TTL 的内存缓存）
+    get_jira_board_story = await tag_rules_cache.prompt(STORY_LIST_PROMPT_TEMPLATE)
 
     try:
         # 1. Mock 模式处理
@@ -165,18 +210,21 @@ async def story_list(request: ChatRequest):
                 "approval_mode": "yolo"
             }
 
-            result = gemini_client.chat(
+            result = await run_until_disconnected(http_request, gemini_client.achat(
                 get_jira_board_story,
                 model=request.model,
+                cache_ttl=STORY_LIST_CACHE_TTL,
+                force=should_bypass_cache(request.force, cache_control),
                 mcp_servers=['jira'],
                 **kwargs
-            )
+            ))
 
         # 3. 错误处理
         if not result["success"]:
             raise HTTPException(
-                status_code=500,
-                detail=result.get("error", "Unknown error occurred")
+                status_code=result.get("status_code", 500),
+                detail=result.get("error", "Unknown error occurred"),
+                headers=result.get("headers")
             )
 
         # 4. 返回结果
@@ -188,13 +236,17 @@ async def story_list(request: ChatRequest):
             json_str = response_content.split('```json')[1].split('```')[0].strip()
             try:
                 stories = json.loads(json_str)
-                expiry = 30 * 24 * 60 * 60  # 1 month in seconds
+                story_tags_map = {}
                 for story in stories:
                     story_key = story.get('key')
                     story_tags = story.get('tags')
                     if story_key and story_tags is not None:
-                        tags_redis_key = f"story:tags:{story_key}"
-                        set_redis(tags_redis_key, story_tags, expiry_seconds=expiry)
+                        story_tags_map[story_key] = story_tags
+                # 所有 story 的标签一次写入（一次往返），随后更新版本号
+                if STORY_TAGS_BACKGROUND_WRITE:
+                    background_tasks.add_task(save_story_tags, story_tags_map, expiry_seconds=STORY_TAGS_EXPIRY)
+                else:
+                    await asyncio.to_thread(save_story_tags, story_tags_map, expiry_seconds=STORY_TAGS_EXPIRY)
             except json.JSONDecodeError as e:
                 print(f"Failed to parse JSON from response for redis caching: {e}")
             except Exception as e:
@@ -215,10 +267,9 @@ async def story_list(request: ChatRequest):
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
-@router.post("/api/gemini/story/check", response_model=ChatResponse)
-async def story_check(request: ChatRequest):
+def _build_story_check_prompt(jira_id: str) -> str:
     """
-    story风险分析，并记录追踪分析当前story下所有sub-task的最近两日工作进展
+    构建 story 风险分析的 prompt
     """
 
     jira_story_check = """
@@ -318,18 +369,32 @@ async def story_check(request: ChatRequest):
     *注：报表生成时间 {{CURRENT_DATE}}*
     """
 
-    jira_story_check = jira_story_check.replace("{{STORY_KEY}}", request.jira_id)
+    jira_story_check = jira_story_check.replace("{{STORY_KEY}}", jira_id)
     jira_story_check = jira_story_check.replace("{{CURRENT_DATE}}", datetime.datetime.now().strftime("%Y-%m-%d"))
+    return jira_story_check
+
+
+# story_check 的 mock 返回结果
+STORY_CHECK_MOCK_RESULT = {
+    "success": True,
+    "response": "## 🚁 Plum 25R3.3 Sprint 1 : ORI-114277 整体进展综述\n> **当前状态**: Closed | **整体进度**: 11/11\n> **风险提示**: 无风险\n\n**📝 最新情况摘要**:\n该 Story 已完成并关闭，其全部 11 个子任务也均已关闭。过去两天内无进行中的工作，仅有一条关于“客户配置检查” (ORI-135351) 的关闭评论，确认该项无需特定配置。整个 Story 已无未解决风险。\n\n---\n\n## 👥 团队成员详细动态 (过去两天)\n\n### 👤 Zijie Tang\n\n#### 🔹 ORI-135351 客户配置检查 (🔵 task)\n* **[2026-01-29]**:\n    * **[Comment]** 新功能，前后端的新逻辑，对于原始的 affect-other 走的逻辑一致，无配置检查。\n* **[2026-01-30]**:\n    * *(无新增动态)*\n\n---\n*注：报表生成时间 2026-01-31*",
+    "error": None,
+    "logs": "(node:4184) [DEP0040] DeprecationWarning: The `punycode` module is deprecated. Please use a userland alternative instead.\n(Use `node --trace-deprecation ...` to show where the warning was created)\n(node:4200) [DEP0040] DeprecationWarning: The `punycode` module is deprecated. Please use a userland alternative instead.\n(Use `node --trace-deprecation ...` to show where the warning was created)\nYOLO mode is enabled. All tool calls will be automatically approved.\nLoaded cached credentials.\nYOLO mode is enabled. All tool calls will be automatically approved.\nHook registry initialized with 0 hook entries\nServer 'jira' supports tool updates. Listening for changes..."
+}
+
+
+@router.post("/api/gemini/story/check", response_model=ChatResponse)
+async def story_check(request: ChatRequest, http_request: Request,
+                     cache_control: Optional[str] = Header(None)):
+    """
+    story风险分析，并记录追踪分析当前story下所有sub-task的最近两日工作进展
+    """
+    jira_story_check = _build_story_check_prompt(request.jira_id)
 
     try:
         if request.mock:
             await asyncio.sleep(3)
-            result = {
-                "success": True,
-                "response": "## 🚁 Plum 25R3.3 Sprint 1 : ORI-114277 整体进展综述\n> **当前状态**: Closed | **整体进度**: 11/11\n> **风险提示**: 无风险\n\n**📝 最新情况摘要**:\n该 Story 已完成并关闭，其全部 11 个子任务也均已关闭。过去两天内无进行中的工作，仅有一条关于“客户配置检查” (ORI-135351) 的关闭评论，确认该项无需特定配置。整个 Story 已无未解决风险。\n\n---\n\n## 👥 团队成员详细动态 (过去两天)\n\n### 👤 Zijie Tang\n\n#### 🔹 ORI-135351 客户配置检查 (🔵 task)\n* **[2026-01-29]**:\n    * **[Comment]** 新功能，前后端的新逻辑，对于原始的 affect-other 走的逻辑一致，无配置检查。\n* **[2026-01-30]**:\n    * *(无新增动态)*\n\n---\n*注：报表生成时间 2026-01-31*",
-                "error": None,
-                "logs": "(node:4184) [DEP0040] DeprecationWarning: The `punycode` module is deprecated. Please use a userland alternative instead.\n(Use `node --trace-deprecation ...` to show where the warning was created)\n(node:4200) [DEP0040] DeprecationWarning: The `punycode` module is deprecated. Please use a userland alternative instead.\n(Use `node --trace-deprecation ...` to show where the warning was created)\nYOLO mode is enabled. All tool calls will be automatically approved.\nLoaded cached credentials.\nYOLO mode is enabled. All tool calls will be automatically approved.\nHook registry initialized with 0 hook entries\nServer 'jira' supports tool updates. Listening for changes..."
-            }
+            result = dict(STORY_CHECK_MOCK_RESULT)
 
         else:
             # 强制指定参数：使用 jira server，开启 yolo 模式
@@ -337,20 +402,23 @@ async def story_check(request: ChatRequest):
                 "approval_mode": "yolo"
             }
 
-            result = gemini_client.chat(
+            result = await run_until_disconnected(http_request, gemini_client.achat(
                 jira_story_check,
                 model=request.model,
+                cache_ttl=STORY_CHECK_CACHE_TTL,
+                force=should_bypass_cache(request.force, cache_control),
                 mcp_servers=['jira'],  # 这里的逻辑是写死的，如你所愿
                 **kwargs
-            )
+            ))
         if not result["success"]:
             raise HTTPException(
-                status_code=500,
-                detail=result.get("error", "Unknown error occurred")
+                status_code=result.get("status_code", 500),
+                detail=result.get("error", "Unknown error occurred"),
+                headers=result.get("headers")
             )
         print(f">>> story_check, {request.jira_id}, {result['response']}")
 
-        parse_to_json(result['response'], request.jira_id)
+        await asyncio.to_thread(parse_to_json, result['response'], request.jira_id)
         return ChatResponse(
             success=True,
             response=result["response"],
@@ -364,3 +432,38 @@ async def story_check(request: ChatRequest):
     except Exception as e:
         # 捕获其他未知异常
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.post("/api/gemini/story/check/stream")
+async def story_check_stream(request: ChatRequest, cache_control: Optional[str] = Header(None)):
+    """
+    story_check 的流式版本（Server-Sent Events）
+
+    gemini 每输出一段就推送一个 chunk 事件，结束时推送 done 事件（携带 error/logs），
+    成功时同样会把结果解析并写入 Redis
+    """
+    jira_story_check = _build_story_check_prompt(request.jira_id)
+
+    async def mock_events():
+        await asyncio.sleep(3)
+        yield "chunk", STORY_CHECK_MOCK_RESULT["response"]
+        yield "done", dict(STORY_CHECK_MOCK_RESULT)
+
+    if request.mock:
+        events = mock_events()
+    else:
+        # 强制指定参数：使用 jira server，开启 yolo 模式
+        events = gemini_client.astream_chat(
+            jira_story_check,
+            model=request.model,
+            mcp_servers=['jira'],
+            cache_ttl=STORY_CHECK_CACHE_TTL,
+            force=should_bypass_cache(request.force, cache_control),
+            approval_mode="yolo"
+        )
+
+    async def save_result(result):
+        if result.get("success"):
+            await asyncio.to_thread(parse_to_json, result["response"], request.jira_id)
+
+    return sse_response(gemini_sse_events(events, on_done=save_result))
@@ -1,11 +1,15 @@
 from typing import Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from admission_control import admission_controller
 from gemini_client import gemini_client
-from gemini_session_simple import get_session
+from gemini_session_simple import session_key, session_registry
 from jira_story_process import router as jira_router
-from models import ChatRequest, ChatResponse, SessionStartRequest
+from models import DEFAULT_USER_EMAIL, ChatRequest, ChatResponse, SessionStartRequest
+from request_cancellation import cancellation_stats, run_until_disconnected
+from streaming import gemini_sse_events, sse_response
+from tag_rules import tag_rules_cache
 
 app = FastAPI(title="Personal Assistant API", version="1.o.0")
 
@@ -20,8 +24,33 @@ app.add_middleware(
 
 app.include_router(jira_router)
 
+
+@app.on_event("shutdown")
+async def shutdown_worker_pool():
+    """服务关闭时清理预热的 gemini 进程"""
+    gemini_client.worker_pool.drain()
+
+def _build_chat_kwargs(request: ChatRequest) -> dict:
+    """
+    根据请求构建传给 gemini-cli 的额外参数
+    """
+    kwargs = {}
+    if request.temperature is not None:
+        kwargs["temperature"] = request.temperature
+    if request.max_tokens is not None:
+        kwargs["max_tokens"] = request.max_tokens
+    if request.approval_mode is not None:
+        kwargs["approval_mode"] = request.approval_mode
+
+    # 如果使用了 MCP 服务器但没有指定审批模式，默认使用 yolo 模式以自动批准工具执行
+    if request.approval_mode is None and request.mcp_servers:
+        kwargs["approval_mode"] = "yolo"
+
+    return kwargs
+
+
 @app.post("/api/gemini/chat", response_model=ChatResponse)
-async def chat_with_gemini(request: ChatRequest):
+async def chat_with_gemini(request: ChatRequest, http_request: Request):
     """
     与 gemini-cli 交互的接口
     
@@ -30,34 +59,23 @@ async def chat_with_gemini(request: ChatRequest):
     try:
         # 如果提供了自定义参数，使用 chat_with_args
         if request.args:
-            result = gemini_client.chat_with_args(request.message, request.args)
+            result = await run_until_disconnected(
+                http_request,
+                gemini_client.achat_with_args(request.message, request.args)
+            )
         else:
-            # 构建 kwargs
-            kwargs = {}
-            if request.temperature is not None:
-                kwargs["temperature"] = request.temperature
-            if request.max_tokens is not None:
-                kwargs["max_tokens"] = request.max_tokens
-            if request.approval_mode is not None:
-                kwargs["approval_mode"] = request.approval_mode
-
-            # 如果使用了 MCP 服务器但没有指定审批模式，默认使用 yolo 模式以自动批准工具执行
-            approval_mode = request.approval_mode
-            if approval_mode is None and request.mcp_servers:
-                approval_mode = "yolo"
-                kwargs["approval_mode"] = approval_mode
-
-            result = gemini_client.chat(
+            result = await run_until_disconnected(http_request, gemini_client.achat(
                 request.message,
                 model=request.model,
                 mcp_servers=request.mcp_servers,
-                **kwargs
-            )
+                **_build_chat_kwargs(request)
+            ))
 
         if not result["success"]:
             raise HTTPException(
-                status_code=500,
-                detail=result.get("error", "Unknown error occurred")
+                status_code=result.get("status_code", 500),
+                detail=result.get("error", "Unknown error occurred"),
+                headers=result.get("headers")
             )
 
         return ChatResponse(
@@ -73,23 +91,70 @@ async def chat_with_gemini(request: ChatRequest):
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+@app.post("/api/gemini/chat/stream")
+async def chat_with_gemini_stream(request: ChatRequest):
+    """
+    与 gemini-cli 交互的流式接口（Server-Sent Events）
+
+    gemini 每输出一段就推送一个 chunk 事件 {"text": "..."}，
+    结束时推送一个 done 事件，携带 success/error/logs/return_code
+    """
+    if request.args:
+        events = gemini_client.astream_chat_with_args(request.message, request.args)
+    else:
+        events = gemini_client.astream_chat(
+            request.message,
+            model=request.model,
+            mcp_servers=request.mcp_servers,
+            **_build_chat_kwargs(request)
+        )
+    return sse_response(gemini_sse_events(events))
+
+
 @app.get("/api/gemini/health")
-async def gemini_health():
+async def gemini_health(refresh: bool = False):
     """
     检查 gemini-cli 是否可用（快速检查，不执行实际命令）
+
+    refresh=true 时重新查找 gemini-cli 并重建环境变量
     """
-    return gemini_client.is_available()
+    return gemini_client.is_available(refresh=refresh)
+
+
+@app.get("/api/gemini/stats")
+async def gemini_stats():
+    """
+    获取 gemini 调用相关的运行指标（进程池命中率、缓存命中率、合并请求数、排队情况、取消次数等）
+    """
+    return {
+        "worker_pool": gemini_client.worker_pool.stats(),
+        "response_cache": gemini_client.response_cache.stats(),
+        "single_flight": gemini_client.single_flight.stats(),
+        "admission": admission_controller.stats(),
+        "cancellation": cancellation_stats.stats(),
+        "tag_rules": tag_rules_cache.stats(),
+        "sessions": session_registry.status()
+    }
+
+
+@app.get("/api/gemini/circuit-breakers")
+async def get_circuit_breakers():
+    """
+    获取各模型熔断器的状态、降级链以及最近的状态变化
+    """
+    return gemini_client.breakers.status()
 
 
 @app.get("/api/gemini/mcp-servers")
 async def get_mcp_servers():
     """
-    获取可用的 MCP 服务器列表（从 settings.json 读取）
+    获取可用的 MCP 服务器列表（从 settings.json 读取，文件修改后自动生效）
     """
-    servers = gemini_client.get_available_mcp_servers()
+    mcp_servers = gemini_client.mcp_registry.servers()
+    servers = list(mcp_servers.keys())
     server_details = {}
     for server_name in servers:
-        server_config = gemini_client._mcp_servers.get(server_name, {})
+        server_config = mcp_servers.get(server_name, {})
         server_details[server_name] = {
             "name": server_name,
             "type": "http" if "httpUrl" in server_config else "command" if "command" in server_config else "unknown",
@@ -98,20 +163,21 @@ async def get_mcp_servers():
 
     return {
         "available_servers": servers,
-        "server_details": server_details
+        "server_details": server_details,
+        "registry": gemini_client.mcp_registry.status()
     }
 
 
 @app.post("/api/gemini/chat-session", response_model=ChatResponse)
-async def chat_with_gemini_session(request: ChatRequest):
+async def chat_with_gemini_session(request: ChatRequest, http_request: Request):
     """
     使用会话模式与 gemini-cli 交互（长连接）
 
-    首次请求会启动一个 gemini 进程，后续请求会复用同一个进程和会话
-    这样可以保持对话上下文和 MCP 连接
+    会话按 session_id（未传时按 user_email）区分，每个会话有独立的工作目录和上下文，
+    同一会话的请求依次执行，不同会话可以并发
     """
     try:
-        session = get_session()
+        session = session_registry.get(session_key(request.session_id, request.user_email))
 
         # 如果使用了 MCP 服务器但没有指定审批模式，默认使用 yolo 模式
         approval_mode = request.approval_mode
@@ -120,7 +186,7 @@ async def chat_with_gemini_session(request: ChatRequest):
 
         # 确保会话已启动（如果还没启动）
         if not session.is_running:
-            success = session.start(
+            success = await session.astart(
                 model=request.model,
                 mcp_servers=request.mcp_servers,
                 approval_mode=approval_mode or "yolo"
@@ -132,12 +198,13 @@ async def chat_with_gemini_session(request: ChatRequest):
                 )
 
         # 发送消息
-        result = session.chat(request.message, timeout=300)
+        result = await run_until_disconnected(http_request, session.achat(request.message, timeout=300))
 
         if not result["success"]:
             raise HTTPException(
-                status_code=500,
-                detail=result.get("error", "Unknown error occurred")
+                status_code=result.get("status_code", 500),
+                detail=result.get("error", "Unknown error occurred"),
+                headers=result.get("headers")
             )
 
         return ChatResponse(
@@ -163,7 +230,8 @@ async def start_session(request: Optional[SessionStartRequest] = None):
     如果会话已经在运行，会返回当前状态
     """
     try:
-        session = get_session()
+        req = request or SessionStartRequest()
+        session = session_registry.get(session_key(req.session_id, req.user_email))
 
         if session.is_running:
             return {
@@ -172,8 +240,7 @@ async def start_session(request: Optional[SessionStartRequest] = None):
                 "is_running": True
             }
 
-        req = request or SessionStartRequest()
-        success = session.start(
+        success = await session.astart(
             model=req.model,
             mcp_servers=req.mcp_servers,
             approval_mode=req.approval_mode
@@ -198,13 +265,12 @@ async def start_session(request: Optional[SessionStartRequest] = None):
 
 
 @app.post("/api/gemini/session/stop")
-async def stop_session():
+async def stop_session(session_id: Optional[str] = None, user_email: Optional[str] = DEFAULT_USER_EMAIL):
     """
-    停止会话
+    停止会话并释放其工作目录
     """
     try:
-        session = get_session()
-        session.stop()
+        session_registry.remove(session_key(session_id, user_email))
 
         return {
             "success": True,
@@ -217,21 +283,21 @@ async def stop_session():
 
 
 @app.get("/api/gemini/session/status")
-async def get_session_status():
+async def get_session_status(session_id: Optional[str] = None, user_email: Optional[str] = DEFAULT_USER_EMAIL):
     """
     获取会话状态
+
+    会话的选择方式与 /chat-session 相同；所有会话的概况见 /api/gemini/stats
     """
     try:
-        session = get_session()
-
-        return {
-            "is_running": session.is_running,
-            "session_initialized": session.session_initialized,
-            "session_id": session.session_id,
-            "model": session.model,
-            "mcp_servers": session.mcp_servers,
-            "approval_mode": session.approval_mode
-        }
+        session = session_registry.get(session_key(session_id, user_email), create=False)
+        if session is None:
+            return {
+                "is_running": False,
+                "session_initialized": False,
+                "session_id": None
+            }
+        return session.status()
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -0,0 +1,117 @@
+"""
+MCP 服务器配置注册表
+从 ~/.gemini/settings.json 读取 mcpServers，并按文件 mtime 检查是否需要重新加载：
+接口直接读取内存中的解析结果，修改配置后无需重启服务；配置变化时通知订阅者（例如清空预热进程池）。
+"""
+import json
+import os
+import threading
+import time
+from typing import Optional, Dict, Any, List, Callable
+
+
+# 两次检查 settings.json mtime 的最小间隔（秒）
+GEMINI_MCP_RELOAD_INTERVAL = float(os.environ.get("GEMINI_MCP_RELOAD_INTERVAL", "1"))
+
+
+class MCPServerRegistry:
+    """按 mtime 热加载的 MCP 服务器配置"""
+
+    def __init__(self, settings_path: str, check_interval: float = GEMINI_MCP_RELOAD_INTERVAL):
+        """
+        初始化注册表
+
+        Args:
+            settings_path: settings.json 的路径
+            check_interval: 两次检查 mtime 的最小间隔（秒）
+        """
+        self.settings_path = settings_path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._servers: Dict[str, Any] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._loaded_at: Optional[float] = None
+        self._listeners: List[Callable[[Dict[str, Any], Dict[str, Any]], None]] = []
+
+        self.version = 0
+        self.last_error: Optional[str] = None
+
+    def subscribe(self, listener: Callable[[Dict[str, Any], Dict[str, Any]], None]):
+        """
+        订阅配置变化
+
+        Args:
+            listener: 回调函数，参数为 (旧配置, 新配置)
+        """
+        self._listeners.append(listener)
+
+    def servers(self) -> Dict[str, Any]:
+        """
+        获取当前的 MCP 服务器配置（必要时先检查文件是否变化）
+
+        Returns:
+            服务器名称 -> 配置 的字典（共享对象，调用方不要修改）
+        """
+        now = time.monotonic()
+        if self._loaded_at is None or now - self._checked_at >= self.check_interval:
+            self._refresh(now)
+        return self._servers
+
+    def reload(self) -> Dict[str, Any]:
+        """忽略检查间隔，立即检查并重新加载配置"""
+        self._refresh(time.monotonic(), force=True)
+        return self._servers
+
+    def _refresh(self, now: float, force: bool = False):
+        """mtime 变化（或文件被删除）时重新解析 settings.json"""
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.settings_path).st_mtime
+            except OSError:
+                mtime = None
+
+            if not force and self._loaded_at is not None and mtime == self._mtime:
+                return
+
+            servers: Dict[str, Any] = {}
+            if mtime is not None:
+                try:
+                    with open(self.settings_path, 'r', encoding='utf-8') as f:
+                        settings = json.load(f)
+                    servers = settings.get("mcpServers", {})
+                    self.last_error = None
+                except Exception as e:
+                    # 文件正在编辑或格式错误时保留上一次的有效配置，下次 mtime 变化再重试
+                    self.last_error = str(e)
+                    self._mtime = mtime
+                    self._loaded_at = self._loaded_at or time.time()
+                    return
+
+            self._mtime = mtime
+            self._loaded_at = time.time()
+            old_servers, self._servers = self._servers, servers
+            if old_servers == servers:
+                return
+            self.version += 1
+
+        for listener in self._listeners:
+            try:
+                listener(old_servers, servers)
+            except Exception as e:
+                print(f"通知 MCP 配置变化失败: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        """
+        获取注册表状态
+
+        Returns:
+            包含配置文件路径、版本号、加载时间等信息的字典
+        """
+        return {
+            "settings_path": self.settings_path,
+            "version": self.version,
+            "loaded_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self._loaded_at)) if self._loaded_at else None,
+            "last_error": self.last_error
+        }
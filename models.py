@@ -2,10 +2,14 @@ from pydantic import BaseModel
 from typing import Optional, List
 
 
+# 未传 user_email 时使用的默认用户（会话模式下同时决定使用哪个会话）
+DEFAULT_USER_EMAIL = "chuan.huang@veeva.com"
+
+
 class ChatRequest(BaseModel):
     """聊天请求模型"""
     mock: Optional[bool] = True
-    user_email: Optional[str] = "chuan.huang@veeva.com"
+    user_email: Optional[str] = DEFAULT_USER_EMAIL
     jira_id: Optional[str] = None
     message: Optional[str] = ''
     prompt_key: Optional[str] = 'default'
@@ -15,6 +19,8 @@ class ChatRequest(BaseModel):
     mcp_servers: Optional[List[str]] = None  # 要使用的 MCP 服务器名称列表（如 ["geminix", "jira"]）
     approval_mode: Optional[str] = None  # 审批模式: "default", "auto_edit", "yolo" (默认: 使用 MCP 时自动设为 "yolo")
     args: Optional[List[str]] = None  # 自定义命令行参数
+    force: Optional[bool] = False  # 跳过响应缓存，强制重新调用 gemini
+    session_id: Optional[str] = None  # 会话模式下的会话 ID（不传则按 user_email 区分会话）
 
 
 class ChatResponse(BaseModel):
@@ -26,6 +32,13 @@ class ChatResponse(BaseModel):
 
 class SessionStartRequest(BaseModel):
     """会话启动请求模型"""
+    session_id: Optional[str] = None
+    user_email: Optional[str] = DEFAULT_USER_EMAIL  # 与 ChatRequest 相同，保证不传参数时和 /chat-session 使用同一个会话
     model: Optional[str] = None
     mcp_servers: Optional[List[str]] = None
     approval_mode: str = "yolo"
+
+
+class StoryDescriptionsRequest(BaseModel):
+    """批量获取 story 描述的请求模型"""
+    story_ids: List[str]
@@ -0,0 +1,136 @@
+"""
+gemini 子进程输出捕获
+stdout / stderr 按块写入 SpooledTemporaryFile：小输出留在内存，超过阈值后转存到临时文件；
+总大小超过硬上限时抛出 OutputLimitExceeded，由调用方结束整个进程组，
+避免失控的工具调用循环把几百 MB 的输出读进 API 进程。
+"""
+import asyncio
+import codecs
+import io
+import os
+import tempfile
+from typing import Iterator, Optional, BinaryIO
+
+
+# 单个输出流留在内存中的最大字节数，超过后转存到临时文件
+GEMINI_OUTPUT_SPOOL_BYTES = int(os.environ.get("GEMINI_OUTPUT_SPOOL_BYTES", str(1024 * 1024)))
+# 单个输出流的硬上限（字节），超过后结束 gemini 进程
+GEMINI_OUTPUT_MAX_BYTES = int(os.environ.get("GEMINI_OUTPUT_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# 每次从管道读取的最大字节数
+CAPTURE_CHUNK_SIZE = 64 * 1024
+
+
+class OutputLimitExceeded(Exception):
+    """gemini 输出超过硬上限"""
+
+    def __init__(self, stream: str, max_bytes: int):
+        super().__init__(f"gemini {stream} output exceeded {max_bytes} bytes, process terminated")
+        self.stream = stream
+        self.max_bytes = max_bytes
+
+
+class CapturedOutput:
+    """一个输出流的捕获结果（内存 / 临时文件）"""
+
+    def __init__(self, name: str, spool_bytes: int = GEMINI_OUTPUT_SPOOL_BYTES,
+                 max_bytes: int = GEMINI_OUTPUT_MAX_BYTES):
+        """
+        初始化捕获缓冲区
+
+        Args:
+            name: 输出流名称（stdout / stderr），用于错误信息
+            spool_bytes: 留在内存中的最大字节数
+            max_bytes: 硬上限（字节）
+        """
+        self.name = name
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __enter__(self) -> "CapturedOutput":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def spilled(self) -> bool:
+        """是否已经转存到临时文件"""
+        return bool(getattr(self._file, "_rolled", False))
+
+    def write(self, data: bytes):
+        """
+        追加一块输出
+
+        Raises:
+            OutputLimitExceeded: 总大小超过硬上限
+        """
+        if self.size + len(data) > self.max_bytes:
+            raise OutputLimitExceeded(self.name, self.max_bytes)
+        self._file.write(data)
+        self.size += len(data)
+
+    def text(self, max_bytes: Optional[int] = None) -> str:
+        """
+        一次性解码为字符串
+
+        Args:
+            max_bytes: 最多读取的字节数，None 表示全部
+        """
+        self._file.seek(0)
+        data = self._file.read() if max_bytes is None else self._file.read(max_bytes)
+        return data.decode("utf-8", errors="replace")
+
+    def __iter__(self) -> Iterator[str]:
+        """逐行解码（不把整个输出拼成一个字符串），供 classify_stderr 使用"""
+        self._file.seek(0)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        pending = ""
+        while True:
+            data = self._file.read(CAPTURE_CHUNK_SIZE)
+            pending += decoder.decode(data, final=not data)
+            lines = pending.splitlines(keepends=True)
+            if data and lines and not lines[-1].endswith(("\n", "\r")):
+                pending = lines.pop()
+            else:
+                pending = ""
+            for line in lines:
+                yield line
+            if not data:
+                break
+
+    def close(self):
+        self._file.close()
+
+
+async def capture_stream(stream: asyncio.StreamReader, capture: CapturedOutput):
+    """
+    把 asyncio 管道中的输出全部读入 capture
+
+    Raises:
+        OutputLimitExceeded: 超过硬上限（调用方负责结束进程）
+    """
+    while True:
+        data = await stream.read(CAPTURE_CHUNK_SIZE)
+        if not data:
+            return
+        capture.write(data)
+
+
+def capture_stream_sync(stream: BinaryIO, capture: CapturedOutput):
+    """
+    把同步管道中的输出全部读入 capture（在读取线程中运行）
+
+    Raises:
+        OutputLimitExceeded: 超过硬上限（调用方负责结束进程）
+    """
+    read = stream.read1 if isinstance(stream, io.BufferedReader) else stream.read
+    while True:
+        data = read(CAPTURE_CHUNK_SIZE)
+        if not data:
+            return
+        capture.write(data)
@@ -1,31 +1,368 @@
+import asyncio
+import functools
+import hashlib
+import itertools
+import os
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
 import requests
 import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+try:
+    import redis
+except ImportError:  # optional: only needed for REDIS_BACKEND=resp
+    redis = None
 
-def query_redis(method: str, key: str) -> dict:
-    url = f"http://localhost:7379/{method}/{key}"
-    data = {}
-    try:
-        response = requests.get(url)
+
+# webdis gateway in front of Redis
+WEBDIS_URL = os.environ.get("WEBDIS_URL", "http://localhost:7379").rstrip("/")
+# Seconds to wait for the TCP connection / for webdis to answer
+REDIS_CONNECT_TIMEOUT = float(os.environ.get("REDIS_CONNECT_TIMEOUT", "1"))
+REDIS_READ_TIMEOUT = float(os.environ.get("REDIS_READ_TIMEOUT", "5"))
+# Retries for connection errors, read timeouts and 502/503/504. Only idempotent calls (GET/MGET/SET/SETEX,
+# EVAL of SETs or reads) use them all; INCR and MERGE_RECORDS_SCRIPT calls, which would apply twice if a
+# timed-out request had already run, retry only failed connection attempts (webdis) or not at all (resp).
+REDIS_RETRIES = int(os.environ.get("REDIS_RETRIES", "2"))
+# Keep-alive connections kept open to webdis / Redis
+REDIS_POOL_SIZE = int(os.environ.get("REDIS_POOL_SIZE", "16"))
+# "webdis" (HTTP gateway, default) or "resp" (talk to Redis directly, needs `pip install "redis>=5.3"`)
+REDIS_BACKEND = os.environ.get("REDIS_BACKEND", "webdis").lower()
+# Redis address for the resp backend
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+# Oldest redis-py the resp backend supports: pool.get_connection() without a command name
+REDIS_PY_MIN_VERSION = (5, 3)
+
+_sessions: Dict[bool, requests.Session] = {}
+_session_lock = threading.Lock()
+
+
+def get_http_session(idempotent: bool = True) -> requests.Session:
+    """
+    Shared keep-alive session for webdis (created on first use).
+    idempotent=False: the session for INCR / merges, which only retries connection errors (nothing was sent yet).
+    """
+    session = _sessions.get(idempotent)
+    if session is None:
+        with _session_lock:
+            session = _sessions.get(idempotent)
+            if session is None:
+                retries = REDIS_RETRIES if idempotent else 0
+                retry = Retry(
+                    total=REDIS_RETRIES,
+                    connect=REDIS_RETRIES,
+                    read=retries,
+                    status=retries,
+                    other=retries,
+                    backoff_factor=0.1,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset(["GET", "PUT", "POST"]),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=REDIS_POOL_SIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _sessions[idempotent] = session
+    return session
+
+
+def _timeout():
+    return (REDIS_CONNECT_TIMEOUT, REDIS_READ_TIMEOUT)
+
+
+# Writes every KEYS[i] = ARGV[i]; the last ARGV is the expiry in seconds ("0" for none)
+SET_MANY_SCRIPT = """
+local expiry = tonumber(ARGV[#ARGV])
+for i = 1, #KEYS do
+    if expiry > 0 then
+        redis.call('SET', KEYS[i], ARGV[i], 'EX', expiry)
+    else
+        redis.call('SET', KEYS[i], ARGV[i])
+    end
+end
+return #KEYS
+"""
+
+# INCR every KEYS[i] (used to bump content versions)
+INCR_MANY_SCRIPT = """
+for i = 1, #KEYS do
+    redis.call('INCR', KEYS[i])
+end
+return #KEYS
+"""
+
+# Value of every KEYS[i] as one JSON string: strings as stored, lists (of JSON elements) joined into a JSON array
+GET_JSON_MANY_SCRIPT = """
+local values = {}
+for i = 1, #KEYS do
+    local key_type = redis.call('TYPE', KEYS[i]).ok
+    if key_type == 'list' then
+        values[i] = '[' .. table.concat(redis.call('LRANGE', KEYS[i], 0, -1), ',') .. ']'
+    elseif key_type == 'string' then
+        values[i] = redis.call('GET', KEYS[i])
+    else
+        values[i] = false
+    end
+end
+return values
+"""
+
+
+# Appends every record in ARGV[2..] whose fingerprint is new to the list KEYS[1], atomically.
+# Fingerprint = SHA1 of the fields named in ARGV[1] (JSON array), joined by \x1f; seen fingerprints live in the set KEYS[2].
+# KEYS[3] (optional) is INCRed when anything was appended. A legacy value (the whole list stored as one JSON
+# string under KEYS[1]) is migrated into the list first. Returns the number of appended records.
+MERGE_RECORDS_SCRIPT = """
+local fields = cjson.decode(ARGV[1])
+local function fingerprint(record)
+    local parts = {}
+    for i, field in ipairs(fields) do
+        local value = record[field]
+        if value == nil or value == cjson.null then
+            value = ''
+        end
+        parts[i] = tostring(value)
+    end
+    return redis.sha1hex(table.concat(parts, '\\31'))
+end
+
+if redis.call('TYPE', KEYS[1]).ok == 'string' then
+    local ok, legacy = pcall(cjson.decode, redis.call('GET', KEYS[1]))
+    redis.call('DEL', KEYS[1])
+    if ok and type(legacy) == 'table' then
+        for _, record in ipairs(legacy) do
+            if redis.call('SADD', KEYS[2], fingerprint(record)) == 1 then
+                redis.call('RPUSH', KEYS[1], cjson.encode(record))
+            end
+        end
+    end
+end
+
+local appended = 0
+for i = 2, #ARGV do
+    if redis.call('SADD', KEYS[2], fingerprint(cjson.decode(ARGV[i]))) == 1 then
+        redis.call('RPUSH', KEYS[1], ARGV[i])
+        appended = appended + 1
+    end
+end
+if appended > 0 and KEYS[3] then
+    redis.call('INCR', KEYS[3])
+end
+return appended
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def script_sha(script: str) -> str:
+    """SHA1 Redis uses to cache a script (for EVALSHA)."""
+    return hashlib.sha1(script.encode("utf-8")).hexdigest()
+
+
+def _is_noscript(result) -> bool:
+    # webdis reports Redis errors as [false, "<message>"]
+    return isinstance(result, list) and len(result) == 2 and result[0] is False and str(result[1]).startswith("NOSCRIPT")
+
+
+class WebdisBackend:
+    """Redis commands over the webdis HTTP/JSON gateway."""
+
+    name = "webdis"
+
+    def query(self, method: str, key: str):
+        """Run a read command; returns the raw value (str / list) or None when the key is missing."""
+        response = get_http_session().get(f"{WEBDIS_URL}/{method}/{key}", timeout=_timeout())
         # A 404 from webdis means the key doesn't exist, which is not an error in our case.
         if response.status_code == 404:
-            return {}
+            return None
         response.raise_for_status()  # Raise an exception for other bad statuses (500, 403, etc.)
+        try:
+            return response.json().get(method)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{e}. Response was: {response.text}")
+
+    def mget(self, keys: List[str]) -> list:
+        """Values for all keys in one MGET (None for missing keys)."""
+        path = "/".join(quote(key, safe="") for key in keys)
+        response = get_http_session().get(f"{WEBDIS_URL}/MGET/{path}", timeout=_timeout())
+        response.raise_for_status()
+        return response.json().get("MGET") or [None] * len(keys)
+
+    def set(self, key: str, value_str: str, expiry_seconds: int = None) -> None:
+        url = f"{WEBDIS_URL}/SET/{key}"
+        if expiry_seconds:
+            # For SETEX, webdis seems to use path parameters for seconds
+            url = f"{WEBDIS_URL}/SETEX/{key}/{expiry_seconds}"
+        # Use the data parameter to send the value in the request body
+        response = get_http_session().put(url, data=value_str, timeout=_timeout())
+        response.raise_for_status()
+
+    def set_many(self, items: Dict[str, str], expiry_seconds: int = None) -> None:
+        # One round trip: an EVAL of SET_MANY_SCRIPT, posted as a webdis command in the request body
+        # (every argument URL-encoded so values may contain '/').
+        args = ["EVAL", SET_MANY_SCRIPT, str(len(items))]
+        args += list(items.keys()) + list(items.values()) + [str(expiry_seconds or 0)]
+        response = self._post_command(args)
+        if response.status_code == 403:
+            # EVAL disabled by the webdis ACL: fall back to one request per key
+            for key, value_str in items.items():
+                self.set(key, value_str, expiry_seconds)
+            return
+        response.raise_for_status()
+
+    def incr_many(self, keys: List[str]) -> None:
+        args = ["EVAL", INCR_MANY_SCRIPT, str(len(keys))] + list(keys)
+        response = self._post_command(args, idempotent=False)
+        if response.status_code == 403:
+            for key in keys:
+                get_http_session(idempotent=False).get(f"{WEBDIS_URL}/INCR/{quote(key, safe='')}",
+                                                       timeout=_timeout()).raise_for_status()
+            return
+        response.raise_for_status()
+
+    def _post_command(self, command: List[str], idempotent: bool = True) -> requests.Response:
+        body = "/".join(quote(arg, safe="") for arg in command)
+        return get_http_session(idempotent).post(f"{WEBDIS_URL}/", data=body.encode("utf-8"), timeout=_timeout())
+
+    def eval(self, script: str, keys: List[str], args: List[str], idempotent: bool = True):
+        """Run a Lua script: EVALSHA (only the 40-byte hash goes over the wire), EVAL when Redis doesn't have it cached yet."""
+        tail = [str(len(keys))] + list(keys) + list(args)
+        response = self._post_command(["EVALSHA", script_sha(script)] + tail, idempotent)
+        try:
+            result = response.json().get("EVALSHA")
+        except ValueError:
+            result = None
+        if _is_noscript(result):
+            # EVAL runs the script and loads it into the script cache for the next EVALSHA
+            response = self._post_command(["EVAL", script] + tail, idempotent)
+            response.raise_for_status()
+            return response.json().get("EVAL")
+        response.raise_for_status()
+        return result
+
+
+class RespBackend:
+    """Redis commands over RESP with a redis-py connection pool (no HTTP framing or JSON re-encoding)."""
+
+    name = "resp"
+
+    def __init__(self, url: str = REDIS_URL):
+        from redis.backoff import ExponentialBackoff
+        from redis.retry import Retry as RedisRetry
+
+        self.client = redis.Redis(
+            # Blocking pool: callers beyond REDIS_POOL_SIZE wait for a free connection instead of failing.
+            # Retry settings belong to the pool's connections (redis-py ignores them on a client given a pool).
+            connection_pool=redis.BlockingConnectionPool.from_url(
+                url,
+                max_connections=REDIS_POOL_SIZE,
+                timeout=REDIS_READ_TIMEOUT,
+                socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+                socket_timeout=REDIS_READ_TIMEOUT,
+                decode_responses=True,
+                retry=RedisRetry(ExponentialBackoff(base=0.1), REDIS_RETRIES),
+                retry_on_error=[redis.ConnectionError, redis.TimeoutError],
+            )
+        )
+
+    def _execute_once(self, *args):
+        """Send a command exactly once: connecting is retried, the command itself is not (for INCR / merges)."""
+        pool = self.client.connection_pool
+        connection = pool.get_connection()
+        try:
+            connection.send_command(*args)
+            return connection.read_response()
+        except (redis.ConnectionError, redis.TimeoutError):
+            connection.disconnect()
+            raise
+        finally:
+            pool.release(connection)
+
+    def query(self, method: str, key: str):
+        return self.client.execute_command(method.upper(), key)
+
+    def mget(self, keys: List[str]) -> list:
+        return self.client.mget(keys)
+
+    def set(self, key: str, value_str: str, expiry_seconds: int = None) -> None:
+        self.client.set(key, value_str, ex=expiry_seconds or None)
+
+    def set_many(self, items: Dict[str, str], expiry_seconds: int = None) -> None:
+        # MULTI/EXEC pipeline: all SETs go out in one round trip and apply atomically
+        with self.client.pipeline(transaction=True) as pipe:
+            for key, value_str in items.items():
+                pipe.set(key, value_str, ex=expiry_seconds or None)
+            pipe.execute()
+
+    def incr_many(self, keys: List[str]) -> None:
+        self.eval(INCR_MANY_SCRIPT, keys, [], idempotent=False)
 
-        response_json = response.json()
-        raw_json_string = response_json.get(method)
+    def eval(self, script: str, keys: List[str], args: List[str], idempotent: bool = True):
+        execute = self.client.execute_command if idempotent else self._execute_once
+        try:
+            return execute("EVALSHA", script_sha(script), len(keys), *keys, *args)
+        except redis.exceptions.NoScriptError:
+            return execute("EVAL", script, len(keys), *keys, *args)
+
+
+_backend = None
+
+
+def get_backend():
+    """Storage backend selected by REDIS_BACKEND; falls back to webdis when RESP is unavailable."""
+    global _backend
+    if _backend is None:
+        with _session_lock:
+            if _backend is None:
+                _backend = _create_backend(REDIS_BACKEND)
+    return _backend
+
+
+def _redis_py_version() -> tuple:
+    parts = []
+    for part in redis.__version__.split(".")[:2]:
+        digits = "".join(itertools.takewhile(str.isdigit, part))
+        parts.append(int(digits or 0))
+    return tuple(parts)
+
+
+def _create_backend(name: str):
+    if name == "resp":
+        if redis is None:
+            print("REDIS_BACKEND=resp but the 'redis' package is not installed, falling back to webdis")
+            return WebdisBackend()
+        if _redis_py_version() < REDIS_PY_MIN_VERSION:
+            print(f"REDIS_BACKEND=resp needs redis>={'.'.join(map(str, REDIS_PY_MIN_VERSION))} "
+                  f"(installed: {redis.__version__}), falling back to webdis")
+            return WebdisBackend()
+        try:
+            backend = RespBackend()
+            backend.client.ping()
+            return backend
+        except Exception as e:
+            print(f"Cannot connect to Redis at {REDIS_URL} ({e}), falling back to webdis")
+    return WebdisBackend()
+
+
+def query_redis(method: str, key: str) -> dict:
+    data = {}
+    try:
+        raw_json_string = get_backend().query(method, key)
 
         if raw_json_string and isinstance(raw_json_string, str):
             data = json.loads(raw_json_string)
         # If the key exists but the value is not a string (e.g. Redis list),
-        # webdis might return it directly as a JSON array.
+        # the backend returns it directly as a list.
         elif raw_json_string and isinstance(raw_json_string, list):
              data = raw_json_string
 
     except requests.exceptions.RequestException as e:
         print(f"Error querying redis key '{key}': {e}")
     except json.JSONDecodeError as e:
-        print(f"Error decoding JSON from redis for key '{key}': {e}. Response was: {response.text}")
+        print(f"Error decoding JSON from redis for key '{key}': {e}")
     except Exception as e:
         # Catch any other unexpected errors
         print(f"An unexpected error occurred in query_redis for key '{key}': {e}")
@@ -33,22 +370,116 @@ def query_redis(method: str, key: str) -> dict:
     return data
 
 
+def _decode_json_values(keys: List[str], raw_values: list) -> list:
+    values = []
+    for key, raw_json_string in zip(keys, raw_values):
+        data = {}
+        if raw_json_string and isinstance(raw_json_string, str):
+            try:
+                data = json.loads(raw_json_string)
+            except json.JSONDecodeError as e:
+                print(f"Error decoding JSON from redis for key '{key}': {e}")
+        values.append(data)
+    return values
+
+
+def query_redis_many(keys: List[str]) -> list:
+    """GET several keys in one MGET round trip; each value is decoded like query_redis ({} when missing or invalid)."""
+    if not keys:
+        return []
+    try:
+        raw_values = get_backend().mget(keys)
+    except Exception as e:
+        print(f"Error querying {len(keys)} redis keys: {e}")
+        return [{} for _ in keys]
+    return _decode_json_values(keys, raw_values)
+
+
+def query_redis_json_many(keys: List[str]) -> list:
+    """Like query_redis_many, but a Redis list of JSON elements is read back as one JSON array (one round trip)."""
+    if not keys:
+        return []
+    try:
+        raw_values = get_backend().eval(GET_JSON_MANY_SCRIPT, keys, [])
+    except Exception as e:
+        print(f"Error querying {len(keys)} redis keys: {e}")
+        return [{} for _ in keys]
+    return _decode_json_values(keys, raw_values)
+
+
 def set_redis(key: str, value, expiry_seconds: int = None) -> None:
     if not isinstance(value, str):
         value_str = json.dumps(value)
     else:
         value_str = value
 
-    command = "SET"
-    url = f"http://localhost:7379/{command}/{key}"
-    
-    if expiry_seconds:
-        # For SETEX, webdis seems to use path parameters for seconds
-        url = f"http://localhost:7379/SETEX/{key}/{expiry_seconds}"
-
     try:
-        # Use the data parameter to send the value in the request body
-        response = requests.put(url, data=value_str)
-        response.raise_for_status()
+        get_backend().set(key, value_str, expiry_seconds)
     except requests.exceptions.RequestException as e:
         print(f"Error setting redis key '{key}': {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred in set_redis for key '{key}': {e}")
+
+
+def set_redis_many(items: Dict[str, object], expiry_seconds: int = None) -> None:
+    """Write several keys in one round trip (non-string values are JSON-encoded like set_redis)."""
+    if not items:
+        return
+    encoded = {key: value if isinstance(value, str) else json.dumps(value) for key, value in items.items()}
+    try:
+        get_backend().set_many(encoded, expiry_seconds)
+    except requests.exceptions.RequestException as e:
+        print(f"Error setting {len(encoded)} redis keys: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred in set_redis_many for {len(encoded)} keys: {e}")
+
+
+def incr_redis_many(keys: List[str]) -> None:
+    """INCR several counters in one round trip."""
+    if not keys:
+        return
+    try:
+        get_backend().incr_many(keys)
+    except requests.exceptions.RequestException as e:
+        print(f"Error incrementing {len(keys)} redis keys: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred in incr_redis_many for {len(keys)} keys: {e}")
+
+
+def eval_redis(script: str, keys: List[str], args: List[str] = (), idempotent: bool = True):
+    """
+    Run a Lua script atomically on the server; returns its raw result, or None on error.
+    Pass idempotent=False for scripts that must not run twice (e.g. INCR), so timed-out calls are not retried.
+    """
+    try:
+        return get_backend().eval(script, keys, [str(arg) for arg in args], idempotent)
+    except requests.exceptions.RequestException as e:
+        print(f"Error running redis script on {keys}: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred in eval_redis for {keys}: {e}")
+    return None
+
+
+def merge_redis_records(list_key: str, fingerprint_key: str, records: List[dict], fields: List[str],
+                        version_key: str = None) -> Optional[int]:
+    """
+    Append the records not seen before to a Redis list, deduplicated by a fingerprint of `fields`.
+    Runs MERGE_RECORDS_SCRIPT: one round trip, atomic, lossless under concurrent writers, no client-side locking.
+    Returns the number of appended records, or None on error.
+    """
+    if not records:
+        return 0
+    keys = [list_key, fingerprint_key] + ([version_key] if version_key else [])
+    args = [json.dumps(fields)] + [json.dumps(record, ensure_ascii=False) for record in records]
+    # Re-running the merge only re-adds known fingerprints, but it would INCR the version key again
+    return eval_redis(MERGE_RECORDS_SCRIPT, keys, args, idempotent=version_key is None)
+
+
+async def aquery_redis(method: str, key: str) -> dict:
+    """query_redis for async handlers: runs in a worker thread so the event loop is never blocked."""
+    return await asyncio.to_thread(query_redis, method, key)
+
+
+async def aset_redis(key: str, value, expiry_seconds: int = None) -> None:
+    """set_redis for async handlers: runs in a worker thread so the event loop is never blocked."""
+    await asyncio.to_thread(set_redis, key, value, expiry_seconds)
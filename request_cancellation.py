@@ -0,0 +1,72 @@
+"""
+请求级取消
+HTTP 客户端断开（关闭 Chrome 插件弹窗、离开 MeetingGenie 页面等）时取消对应的 gemini 调用，
+由 gemini_client 负责结束整个 gemini 进程组，把并发名额及时让给其他请求。
+"""
+import asyncio
+import os
+from typing import Any, Awaitable, Dict
+
+from fastapi import HTTPException, Request
+
+
+# 检查客户端是否断开的间隔（秒）
+GEMINI_DISCONNECT_POLL_SECONDS = float(os.environ.get("GEMINI_DISCONNECT_POLL_SECONDS", "1"))
+
+
+class CancellationStats:
+    """记录 gemini 调用完成 / 因客户端断开而取消的次数"""
+
+    def __init__(self):
+        self.completed = 0
+        self.cancelled = 0
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.completed + self.cancelled
+        return {
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "cancelled_rate": round(self.cancelled / total, 4) if total else 0.0
+        }
+
+
+cancellation_stats = CancellationStats()
+
+
+async def run_until_disconnected(request: Request, awaitable: Awaitable[Any]) -> Any:
+    """
+    执行 gemini 调用，期间定期检查 HTTP 客户端是否已断开，断开则取消调用
+
+    Args:
+        request: 当前的 HTTP 请求
+        awaitable: gemini 调用（例如 gemini_client.achat(...)）
+
+    Returns:
+        awaitable 的返回值
+
+    Raises:
+        HTTPException: 客户端已断开（499），此时响应不会再被发送
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=GEMINI_DISCONNECT_POLL_SECONDS)
+            if done:
+                cancellation_stats.completed += 1
+                return task.result()
+            if await request.is_disconnected():
+                break
+    except asyncio.CancelledError:
+        # 服务器侧取消了当前请求，同样不再需要 gemini 的结果
+        task.cancel()
+        cancellation_stats.cancelled += 1
+        raise
+
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    cancellation_stats.cancelled += 1
+    print("客户端已断开，取消 gemini 调用")
+    raise HTTPException(status_code=499, detail="Client closed request")
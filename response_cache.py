@@ -0,0 +1,165 @@
+"""
+gemini 响应缓存
+以最终 prompt + 命令参数（模型、MCP 服务器、审批模式等）的哈希作为 key，
+内存中维护一个按条数限制的 LRU，可选再加一层 Redis 缓存（跨进程/重启共享）。
+"""
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+
+from redis_utils import aquery_redis, aset_redis
+
+
+# 内存 LRU 最多缓存的响应条数
+GEMINI_CACHE_MAX_ENTRIES = int(os.environ.get("GEMINI_CACHE_MAX_ENTRIES", "128"))
+# 是否启用 Redis 缓存层（"1"/"true" 启用）
+GEMINI_CACHE_REDIS = os.environ.get("GEMINI_CACHE_REDIS", "0").lower() in ("1", "true", "yes")
+
+REDIS_KEY_PREFIX = "gemini:response:"
+
+
+def request_fingerprint(message: str, cmd: List[str]) -> str:
+    """
+    计算一次 gemini 调用的指纹
+
+    Args:
+        message: 最终发送的 prompt
+        cmd: 完整命令列表（第一个元素是可执行文件路径，不参与计算）
+
+    Returns:
+        sha256 十六进制字符串
+    """
+    payload = json.dumps({"args": cmd[1:], "prompt": message}, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def should_bypass_cache(force: Optional[bool] = False, cache_control: Optional[str] = None) -> bool:
+    """
+    判断本次请求是否需要跳过缓存
+
+    Args:
+        force: 请求体中的 force 字段
+        cache_control: 请求头 Cache-Control 的值
+
+    Returns:
+        需要跳过缓存返回 True
+    """
+    if force:
+        return True
+    if cache_control:
+        directives = cache_control.lower()
+        return "no-cache" in directives or "no-store" in directives
+    return False
+
+
+class ResponseCache:
+    """带 TTL 的 gemini 响应缓存（内存 LRU + 可选 Redis）"""
+
+    def __init__(self, max_entries: int = GEMINI_CACHE_MAX_ENTRIES, use_redis: bool = GEMINI_CACHE_REDIS):
+        """
+        初始化响应缓存
+
+        Args:
+            max_entries: 内存中最多缓存的条数
+            use_redis: 是否启用 Redis 缓存层
+        """
+        self.max_entries = max_entries
+        self.use_redis = use_redis
+        # key -> (过期时间戳, 响应字典)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+        # 统计指标
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        读取缓存
+
+        Args:
+            key: request_fingerprint 计算出的指纹
+
+        Returns:
+            命中返回响应字典的副本，否则返回 None
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, result = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return dict(result)
+            del self._entries[key]
+
+        if self.use_redis:
+            cached = await aquery_redis('GET', REDIS_KEY_PREFIX + key)
+            if cached and isinstance(cached, dict):
+                expires_at = cached.pop("_expires_at", 0)
+                if expires_at > time.time():
+                    self._store_memory(key, expires_at, cached)
+                    self.redis_hits += 1
+                    return dict(cached)
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, result: Dict[str, Any], ttl: int):
+        """
+        写入缓存（只应缓存成功的响应）
+
+        Args:
+            key: request_fingerprint 计算出的指纹
+            result: 响应字典
+            ttl: 过期时间（秒）
+        """
+        expires_at = time.time() + ttl
+        self._store_memory(key, expires_at, dict(result))
+        self.stores += 1
+
+        if self.use_redis:
+            payload = dict(result, _expires_at=expires_at)
+            await aset_redis(REDIS_KEY_PREFIX + key, payload, ttl)
+
+    def record_bypass(self):
+        """记录一次跳过缓存的请求"""
+        self.bypasses += 1
+
+    def _store_memory(self, key: str, expires_at: float, result: Dict[str, Any]):
+        """写入内存 LRU，超出容量时淘汰最久未使用的条目"""
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """清空内存缓存"""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计信息
+
+        Returns:
+            包含命中、未命中等指标的字典
+        """
+        lookups = self.memory_hits + self.redis_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "redis_enabled": self.use_redis,
+            "memory_hits": self.memory_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.redis_hits) / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "bypasses": self.bypasses,
+            "evictions": self.evictions
+        }
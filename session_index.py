@@ -0,0 +1,113 @@
+"""
+gemini 会话索引（进程内缓存）
+记录每个工作目录下是否已有可以 --resume 的会话：第一次需要时执行一次 `gemini --list-sessions`，
+之后由成功的 chat 结果更新；工作目录或 gemini 为该目录保存会话文件的目录 mtime 变化时才重新查询，
+避免每次启动会话都多启动一个 Node 进程。
+"""
+import hashlib
+import os
+import threading
+from typing import Optional, Dict, Any, Tuple, Callable
+
+
+# gemini 按项目目录（sha256）保存会话文件的位置
+GEMINI_TMP_DIR = os.path.expanduser("~/.gemini/tmp")
+
+
+def _watched_paths(session_dir: str) -> Tuple[str, str]:
+    """工作目录本身，以及 gemini 为它保存会话文件的目录"""
+    project_hash = hashlib.sha256(session_dir.encode("utf-8")).hexdigest()
+    return session_dir, os.path.join(GEMINI_TMP_DIR, project_hash)
+
+
+def _snapshot(session_dir: str) -> Tuple[Optional[int], ...]:
+    """被监视目录的 mtime（不存在时为 None）"""
+    mtimes = []
+    for path in _watched_paths(session_dir):
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+class SessionIndex:
+    """按工作目录缓存最新会话 ID"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[Tuple[Optional[int], ...], Optional[str]]] = {}
+
+        # 统计指标
+        self.hits = 0
+        self.misses = 0
+
+    def latest(self, session_dir, discover: Callable[[], Optional[str]]) -> Optional[str]:
+        """
+        获取工作目录下最新的会话 ID
+
+        Args:
+            session_dir: 会话工作目录
+            discover: 缓存失效时调用的查询函数（例如执行 `gemini --list-sessions`）
+
+        Returns:
+            会话 ID；没有会话时返回 None
+        """
+        key = str(session_dir)
+        snapshot = _snapshot(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == snapshot:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # 在锁外查询（可能需要几秒）；查询期间目录再次变化时，下次调用会重新查询
+        session_id = discover()
+        with self._lock:
+            self._entries[key] = (snapshot, session_id)
+        return session_id
+
+    def record(self, session_dir, session_id: Optional[str]):
+        """
+        记录一次成功的 chat 之后的会话状态（gemini 已写入会话文件）
+
+        Args:
+            session_dir: 会话工作目录
+            session_id: 之后可以 --resume 的会话 ID
+        """
+        key = str(session_dir)
+        snapshot = _snapshot(key)
+        with self._lock:
+            self._entries[key] = (snapshot, session_id)
+
+    def invalidate(self, session_dir=None):
+        """
+        清除缓存
+
+        Args:
+            session_dir: 只清除该目录的记录，None 表示全部清除
+        """
+        with self._lock:
+            if session_dir is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(session_dir), None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取索引统计信息
+
+        Returns:
+            包含目录数、命中次数、查询次数的字典
+        """
+        with self._lock:
+            return {
+                "directories": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+# 全局会话索引
+session_index = SessionIndex()
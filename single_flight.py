@@ -0,0 +1,79 @@
+"""
+单飞（single-flight）请求合并
+相同指纹的请求同时到达时只真正执行一次，其余请求等待并共享同一个结果。
+"""
+import asyncio
+from typing import Dict, Any, Callable, Awaitable
+
+
+class _Call:
+    """一次正在执行的共享调用"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按 key 合并并发中的相同异步调用"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+
+        # 统计指标
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行 fn，如果相同 key 的调用正在进行则直接等待其结果
+
+        共享调用运行在独立的 Task 中：单个等待者被取消不会影响其他等待者，
+        只有当所有等待者都取消时才会取消底层调用。
+
+        Args:
+            key: 请求指纹
+            fn: 真正执行调用的无参协程函数
+
+        Returns:
+            fn 的返回值（所有等待者拿到的是同一个对象）
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: str, call: _Call):
+        """调用结束后移除记录（避免误删同 key 的新调用）"""
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取请求合并统计信息
+
+        Returns:
+            包含实际执行次数、被合并的等待者数量等指标的字典
+        """
+        requests = self.executions + self.coalesced
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / requests, 4) if requests else 0.0,
+            "in_flight": len(self._calls),
+            "waiters": sum(call.waiters for call in self._calls.values())
+        }
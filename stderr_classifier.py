@@ -0,0 +1,144 @@
+"""
+gemini stderr 分类器
+GeminiCLIClient 与 GeminiSessionSimple 共用：用预编译的正则一次遍历 stderr，
+把每行归为错误或信息性日志，合并重复行（例如反复出现的 punycode 弃用警告），
+并按字节预算截断，保证每个响应里 error/logs 字段的大小有上限。
+"""
+import os
+import re
+from typing import Optional, Tuple, Iterable, Dict, List, Union
+
+
+# error / logs 字段各自最多保留的字节数
+GEMINI_STDERR_MAX_BYTES = int(os.environ.get("GEMINI_STDERR_MAX_BYTES", "16384"))
+
+# 信息性消息的关键词（这些不应该被当作错误）
+INFO_KEYWORDS = [
+    "Loaded cached credentials",
+    "Server",
+    "supports",
+    "Listening for changes",
+    "Listening for",
+    "resource updates",
+    "tool updates",
+    "YOLO mode is enabled",
+]
+
+# 通常错误消息包含 "error", "failed", "exception" 等关键词
+ERROR_INDICATORS = ['error', 'failed', 'exception', 'fatal', 'cannot', "can't"]
+
+INFO_PATTERN = re.compile("|".join(re.escape(keyword) for keyword in INFO_KEYWORDS), re.IGNORECASE)
+ERROR_PATTERN = re.compile("|".join(re.escape(indicator) for indicator in ERROR_INDICATORS), re.IGNORECASE)
+# 去重时忽略 node 进程号，例如 "(node:3466) [DEP0040] ..." 与 "(node:3484) [DEP0040] ..." 视为同一行
+NODE_PID_PATTERN = re.compile(r"^\(node:\d+\)\s*")
+
+
+def is_info_message(message: str) -> bool:
+    """
+    判断消息是否为信息性消息（而非错误）
+
+    Args:
+        message: 要检查的消息
+
+    Returns:
+        如果是信息性消息返回 True，否则返回 False
+    """
+    return bool(message) and INFO_PATTERN.search(message) is not None
+
+
+class _BoundedLines:
+    """按字节预算收集去重后的行"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.lines: List[str] = []
+        self.counts: List[int] = []
+        self.index: Dict[str, int] = {}
+        self.size = 0
+        self.dropped = 0
+
+    def add(self, line: str):
+        key = NODE_PID_PATTERN.sub("", line)
+        position = self.index.get(key)
+        if position is not None:
+            self.counts[position] += 1
+            return
+
+        line_size = len(line.encode("utf-8")) + 1
+        if self.size + line_size > self.max_bytes:
+            self.dropped += 1
+            return
+
+        self.index[key] = len(self.lines)
+        self.lines.append(line)
+        self.counts.append(1)
+        self.size += line_size
+
+    def render(self) -> Optional[str]:
+        if not self.lines and not self.dropped:
+            return None
+        rendered = [
+            line if count == 1 else f"{line} (重复 {count} 次)"
+            for line, count in zip(self.lines, self.counts)
+        ]
+        if self.dropped:
+            rendered.append(f"...（超出 {self.max_bytes} 字节，已省略 {self.dropped} 行）")
+        return "\n".join(rendered)
+
+
+def classify_stderr(
+    stderr: Union[str, Iterable[str], None],
+    max_bytes: int = GEMINI_STDERR_MAX_BYTES
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    解析 stderr 输出，区分错误和信息性消息
+
+    Args:
+        stderr: stderr 内容（字符串或逐行迭代器）
+        max_bytes: error / logs 各自最多保留的字节数
+
+    Returns:
+        (error_message, info_logs) 元组
+        - error_message: 真正的错误消息，如果没有错误则为 None
+        - info_logs: 信息性日志，如果没有则为 None
+    """
+    if not stderr:
+        return None, None
+    lines = stderr.splitlines() if isinstance(stderr, str) else stderr
+
+    error_lines = _BoundedLines(max_bytes)
+    info_lines = _BoundedLines(max_bytes)
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        if INFO_PATTERN.search(line):
+            info_lines.add(line)
+        elif ERROR_PATTERN.search(line):
+            error_lines.add(line)
+        else:
+            # 不确定的消息，默认当作信息性消息
+            info_lines.add(line)
+
+    return error_lines.render(), info_lines.render()
+
+
+def cap_text(text: str, max_bytes: int = GEMINI_STDERR_MAX_BYTES) -> str:
+    """
+    把文本截断到字节预算以内（用于没有分类结果时直接返回 stderr 的场景）
+
+    Args:
+        text: 原始文本
+        max_bytes: 最多保留的字节数
+
+    Returns:
+        截断后的文本
+    """
+    text = text.strip()
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+    head = encoded[:max_bytes].decode("utf-8", errors="ignore")
+    return f"{head}\n...（超出 {max_bytes} 字节，已截断）"
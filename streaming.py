@@ -0,0 +1,84 @@
+"""
+Server-Sent Events 辅助函数
+把 GeminiCLIClient.astream_chat 产出的 ("chunk", text) / ("done", result) 事件转换为 SSE 文本流
+"""
+import inspect
+import json
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from fastapi.responses import StreamingResponse
+
+from request_cancellation import cancellation_stats
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """
+    格式化一条 SSE 消息（data 使用 JSON，保留换行等字符）
+
+    Args:
+        event: 事件名称
+        data: 事件数据
+
+    Returns:
+        SSE 文本
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def gemini_sse_events(
+    events: AsyncIterator[Tuple[str, Any]],
+    on_done: Optional[Callable[[Dict[str, Any]], Union[None, Awaitable[None]]]] = None
+) -> AsyncIterator[str]:
+    """
+    将 gemini 流式事件转换为 SSE 文本
+
+    - chunk 事件: {"text": "..."}
+    - done 事件: 响应字典中除 response 以外的字段（success/error/logs/return_code 等），
+      response 已经通过 chunk 事件完整发送过，不再重复
+
+    Args:
+        events: astream_chat 产出的事件
+        on_done: 收到完整结果后的回调（例如把结果写入 Redis），参数为完整的响应字典；
+                 可以是协程函数，会阻塞的 I/O 应通过 asyncio.to_thread 执行，不要直接在事件循环中调用
+
+    Yields:
+        SSE 文本
+    """
+    finished = False
+    try:
+        async with aclosing(events):
+            async for event, payload in events:
+                if event == "chunk":
+                    yield sse_event("chunk", {"text": payload})
+                    continue
+
+                finished = True
+                if on_done is not None:
+                    try:
+                        outcome = on_done(payload)
+                        if inspect.isawaitable(outcome):
+                            await outcome
+                    except Exception as e:
+                        print(f"处理流式结果时出错: {e}")
+                yield sse_event("done", {key: value for key, value in payload.items() if key != "response"})
+    finally:
+        # 没等到 done 事件就被关闭，说明客户端已断开，gemini 进程组已随 _astream 一起结束
+        if finished:
+            cancellation_stats.completed += 1
+        else:
+            cancellation_stats.cancelled += 1
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    """
+    构建 text/event-stream 响应（关闭缓存和反向代理缓冲）
+    """
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
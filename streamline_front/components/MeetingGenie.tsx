@@ -117,6 +117,8 @@ const MeetingGenie: React.FC = () => {
       const saveUrl = `${REDIS_BASE_URL}/set/${REDIS_KEY_RULES}/${encodeURIComponent(rulesString)}`;
       const response = await fetch(saveUrl, { method: 'GET', mode: 'cors' });
       if (!response.ok) throw new Error('Save failed');
+      // 通知后端丢弃缓存的规则，下一次看板同步立即使用新规则
+      fetch('http://127.0.0.1:8200/api/gemini/board/story/rules/invalidate', { method: 'POST' }).catch(() => {});
       alert('配置已成功持久化至 Redis');
     } catch (err) {
       alert('同步失败，已保存至本地。');
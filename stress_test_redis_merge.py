@@ -0,0 +1,134 @@
+"""
+个人进展记录并发写入压力测试
+
+多个线程同时向同一个 story 写入个人进展记录（模拟 Chrome 插件和 MeetingGenie 同时执行 story_check），
+写入结束后检查记录是否有丢失或重复：
+- merge:  redis_utils.merge_redis_records（Lua 脚本在 Redis 中原子去重追加，parse_to_json 当前的写法）
+- legacy: 读取整个 JSON 列表、在客户端去重、整体写回（旧写法，用于对比，会丢失并发写入的记录）
+
+每个写入线程写入自己独有的记录，再加上所有线程共有的一组记录（验证去重）。
+测试数据写在 --prefix 指定的命名空间下（默认 stress:），结束后删除，不会影响真实数据。
+
+用法:
+    python stress_test_redis_merge.py --writers 16 --records 50
+    REDIS_BACKEND=resp REDIS_URL=redis://localhost:6379/0 python stress_test_redis_merge.py --modes merge
+"""
+import argparse
+import sys
+import threading
+import time
+from typing import Dict, List
+
+import redis_utils
+from analyze_data_storage import PROGRESS_FIELDS
+from redis_utils import merge_redis_records, query_redis, query_redis_json_many, set_redis
+
+
+def build_records(writer: str, count: int) -> List[Dict[str, str]]:
+    """构造与 parse_to_json 结果结构相同的记录"""
+    return [
+        {
+            "User": writer,
+            "Jira_ID": f"ORI-{100000 + i % 7}",
+            "Jira_Title": "【admin】longtext 字段在初始拖入页面时，设置关联字段的固定值输入框，没有展示富文本样式",
+            "Date": f"2026-01-{i % 28 + 1:02d}",
+            "Content": "**[Worklog 1h]**" if i % 2 else "**[Comment]**",
+            "Comment": f"{writer} 的第 {i} 条记录 / 并发写入"
+        }
+        for i in range(count)
+    ]
+
+
+def merge_write(keys: Dict[str, str], batch: List[Dict[str, str]]):
+    if merge_redis_records(keys["list"], keys["fingerprints"], batch, PROGRESS_FIELDS, version_key=keys["version"]) is None:
+        raise RuntimeError("merge_redis_records failed")
+
+
+def legacy_write(keys: Dict[str, str], batch: List[Dict[str, str]]):
+    # 旧的 parse_to_json：读取整个列表 -> 客户端去重 -> 整体写回
+    existing = query_redis("GET", keys["legacy"])
+    final_data = existing if isinstance(existing, list) else []
+    for item in batch:
+        if item not in final_data:
+            final_data.append(item)
+    set_redis(keys["legacy"], final_data)
+
+
+def run_mode(mode: str, keys: Dict[str, str], writers: int, records: int, shared: int, batch_size: int) -> Dict:
+    """所有写入线程同时开始，返回写入结果统计"""
+    write = merge_write if mode == "merge" else legacy_write
+    shared_records = build_records("shared", shared)
+    per_writer = [build_records(f"writer-{w}", records) + shared_records for w in range(writers)]
+    barrier = threading.Barrier(writers)
+    errors = []
+
+    def writer(records_to_write: List[Dict[str, str]]):
+        barrier.wait()
+        try:
+            for start in range(0, len(records_to_write), batch_size):
+                write(keys, records_to_write[start:start + batch_size])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(rows,)) for rows in per_writer]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+
+    stored = query_redis_json_many([keys["list"] if mode == "merge" else keys["legacy"]])[0] or []
+    expected = writers * records + shared
+    unique = {tuple(row.get(field) for field in PROGRESS_FIELDS) for row in stored}
+    writes = writers * -(-(records + shared) // batch_size)
+    return {
+        "mode": mode,
+        "writes": writes,
+        "writes_per_second": round(writes / elapsed, 1),
+        "expected": expected,
+        "stored": len(stored),
+        "lost": expected - len(unique),
+        "duplicates": len(stored) - len(unique),
+        "errors": len(errors)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发写入个人进展记录，检查 merge_redis_records 是否丢失或重复记录")
+    parser.add_argument("--writers", type=int, default=16, help="并发写入线程数")
+    parser.add_argument("--records", type=int, default=50, help="每个线程独有的记录条数")
+    parser.add_argument("--shared", type=int, default=20, help="所有线程都会写入的记录条数（应只保存一份）")
+    parser.add_argument("--batch-size", type=int, default=5, help="每次写入的记录条数")
+    parser.add_argument("--prefix", default="stress:", help="测试数据的 key 前缀")
+    parser.add_argument("--modes", default="merge,legacy", help="要测试的写法（逗号分隔）")
+    args = parser.parse_args()
+
+    keys = {
+        "list": f"{args.prefix}story:personal_progress:STRESS",
+        "fingerprints": f"{args.prefix}story:personal_progress_fp:STRESS",
+        "version": f"{args.prefix}story:version:STRESS",
+        "legacy": f"{args.prefix}story:personal_progress_legacy:STRESS"
+    }
+    backend = redis_utils.get_backend()
+    print(f"backend: {backend.name}, writers: {args.writers}, records: {args.records} + {args.shared} shared")
+
+    failed = False
+    print(f"{'mode':<8}{'writes':>8}{'writes/s':>10}{'expected':>10}{'stored':>8}{'lost':>6}{'dups':>6}{'errors':>8}")
+    for mode in [mode.strip() for mode in args.modes.split(",") if mode.strip()]:
+        for key in keys.values():
+            backend.query("DEL", key)
+        result = run_mode(mode, keys, args.writers, args.records, args.shared, args.batch_size)
+        print(f"{result['mode']:<8}{result['writes']:>8}{result['writes_per_second']:>10}{result['expected']:>10}"
+              f"{result['stored']:>8}{result['lost']:>6}{result['duplicates']:>6}{result['errors']:>8}")
+        if mode == "merge" and (result["lost"] or result["duplicates"] or result["errors"]):
+            failed = True
+
+    # 清理测试数据
+    for key in keys.values():
+        backend.query("DEL", key)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+story 标签规则缓存（进程内）
+MeetingGenie 把 delay / risk 规则保存在 Redis 的 scrum_master_tag_rules 中。
+规则按 TTL 缓存在内存里（read-through），可以通过接口显式失效；
+填入规则后的 prompt 按规则内容的哈希缓存，规则没有被修改时不会重新拼接。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from redis_utils import aquery_redis
+
+
+REDIS_KEY_TAG_RULES = "scrum_master_tag_rules"
+
+# 规则在内存中缓存的时间（秒），0 表示每次都从 Redis 读取
+STORY_TAG_RULES_CACHE_TTL = float(os.environ.get("STORY_TAG_RULES_CACHE_TTL", "60"))
+
+# 每条规则在 prompt 中的缩进
+RULE_INDENT = "           "
+
+
+def _split_rules(tags_data) -> Tuple[List[str], List[str]]:
+    """把 scrum_master_tag_rules 拆成 delay 规则和 risk 规则"""
+    delay_rules = []
+    risk_rules = []
+    for tag in tags_data or []:
+        if tag.get('tagName', '') == 'delay':
+            delay_rules += tag.get('rules', [])
+        elif tag.get('tagName', '') == 'risk':
+            risk_rules += tag.get('rules', [])
+    return delay_rules, risk_rules
+
+
+def render_rules_prompt(template: str, tags_data) -> str:
+    """
+    把规则填入 prompt 模板中的 {{DELAY_RULES}} / {{RISK_RULES}}
+
+    Args:
+        template: prompt 模板
+        tags_data: scrum_master_tag_rules 的内容
+
+    Returns:
+        填好规则的 prompt
+    """
+    delay_rules, risk_rules = _split_rules(tags_data)
+    prompt = template.replace("{{DELAY_RULES}}", '\n'.join(f"{RULE_INDENT}{rule}" for rule in delay_rules))
+    return prompt.replace("{{RISK_RULES}}", '\n'.join(f"{RULE_INDENT}{rule}" for rule in risk_rules))
+
+
+class TagRulesCache:
+    """scrum_master_tag_rules 的 read-through 缓存"""
+
+    def __init__(self, ttl: float = STORY_TAG_RULES_CACHE_TTL):
+        """
+        初始化缓存
+
+        Args:
+            ttl: 规则缓存时间（秒）
+        """
+        self.ttl = ttl
+        self._lock = asyncio.Lock()
+        self._rules = None
+        self._digest: Optional[str] = None
+        self._expires_at = 0.0
+        # (规则哈希, 模板) -> 填好规则的 prompt，只保留当前规则版本
+        self._prompts: Dict[Tuple[str, str], str] = {}
+
+        # 统计指标
+        self.hits = 0
+        self.loads = 0
+        self.renders = 0
+        self.invalidations = 0
+
+    def _fresh(self) -> bool:
+        return time.monotonic() < self._expires_at
+
+    async def _load(self):
+        """从 Redis 读取规则；同一时间只有一个请求去读，其余等待结果"""
+        async with self._lock:
+            if self._fresh():
+                return
+            tags_data = await aquery_redis('get', REDIS_KEY_TAG_RULES)
+            rules = tags_data if isinstance(tags_data, list) else []
+            digest = hashlib.sha256(json.dumps(rules, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+            if digest != self._digest:
+                self._prompts.clear()
+            self._rules = rules
+            self._digest = digest
+            self._expires_at = time.monotonic() + self.ttl
+            self.loads += 1
+
+    async def prompt(self, template: str) -> str:
+        """
+        获取填好当前规则的 prompt
+
+        Args:
+            template: 带 {{DELAY_RULES}} / {{RISK_RULES}} 占位符的 prompt 模板
+
+        Returns:
+            填好规则的 prompt
+        """
+        if self._fresh():
+            self.hits += 1
+        else:
+            await self._load()
+
+        key = (self._digest, template)
+        prompt = self._prompts.get(key)
+        if prompt is None:
+            prompt = render_rules_prompt(template, self._rules)
+            self._prompts[key] = prompt
+            self.renders += 1
+        return prompt
+
+    def invalidate(self):
+        """让下一次请求重新从 Redis 读取规则（规则内容没有变化时仍复用已拼接的 prompt）"""
+        self._expires_at = 0.0
+        self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计信息
+
+        Returns:
+            包含 TTL、命中次数、读取 Redis 次数、拼接次数、失效次数的字典
+        """
+        return {
+            "ttl": self.ttl,
+            "rules_digest": self._digest,
+            "hits": self.hits,
+            "loads": self.loads,
+            "renders": self.renders,
+            "invalidations": self.invalidations
+        }
+
+
+# 全局规则缓存
+tag_rules_cache = TagRulesCache()